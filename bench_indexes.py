@@ -0,0 +1,156 @@
+"""
+Бенчмарк индексов: планы и время горячих запросов до и после миграций.
+
+Все таблицы создаются во временной схеме bench_indexes и удаляются в конце,
+рабочие данные не затрагиваются.
+
+    DATABASE_URL=postgres://... python bench_indexes.py --posts 1000000
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import time
+from datetime import datetime, timedelta
+
+import asyncpg
+from dotenv import load_dotenv
+
+import database
+
+SCHEMA = 'bench_indexes'
+
+# Последняя миграция с индексами для топов - дальше схема posts меняется и запросы ниже к ней не подходят
+INDEXES_MIGRATION = 2
+
+# Те же запросы, по которым rebuild_leaderboards собирает снимки топов, и get_user_channels_count
+QUERIES = {
+    'top_reactions': ('''
+        SELECT p.channel_id, c.username, c.title, p.message_id, p.reactions, p.date
+        FROM posts p
+        JOIN channels c ON p.channel_id = c.id
+        WHERE c.status='approved' AND p.date >= $1 AND p.reactions > 0
+        ORDER BY p.reactions DESC, p.id
+        LIMIT 20
+    ''', 'week_ago'),
+    'top_views': ('''
+        SELECT p.channel_id, c.username, c.title, p.message_id, p.views, p.date
+        FROM posts p
+        JOIN channels c ON p.channel_id = c.id
+        WHERE c.status='approved' AND p.date >= $1 AND p.views > 0
+        ORDER BY p.views DESC, p.id
+        LIMIT 20
+    ''', 'week_ago'),
+    'top_small': ('''
+        SELECT p.channel_id, c.username, c.title, p.message_id, p.views, p.date
+        FROM posts p
+        JOIN channels c ON p.channel_id = c.id
+        WHERE c.status='approved' AND c.subscribers < 3000 AND p.date >= $1 AND p.views > 0
+        ORDER BY p.views DESC, p.id
+        LIMIT 20
+    ''', 'week_ago'),
+    'top_growth': ('''
+        SELECT id, username, title, subscribers, growth_7d, growth_30d
+        FROM channels
+        WHERE status='approved' AND subscribers >= $1
+        ORDER BY growth_7d DESC, id
+        LIMIT 20
+    ''', 'min_subscribers'),
+    'user_channels_count': ('''
+        SELECT COUNT(*) FROM channels WHERE added_by=$1
+    ''', 'user_id'),
+}
+
+
+async def seed(conn, channels_count, posts_count, history_days):
+    """Синтетические каналы и посты за history_days дней"""
+    print(f"🌱 Генерирую {channels_count} каналов и {posts_count} постов...")
+    await conn.execute('''
+        INSERT INTO channels (username, title, added_by, status, subscribers, growth_7d, growth_30d)
+        SELECT '@bench_' || i, 'Канал ' || i, (i % 500) + 1,
+               CASE WHEN i % 10 = 0 THEN 'pending' ELSE 'approved' END,
+               (random() * 50000)::int, random() * 20 - 5, random() * 40 - 10
+        FROM generate_series(1, $1) AS i
+    ''', channels_count)
+    await conn.execute('''
+        INSERT INTO posts (channel_id, message_id, date, views, reactions, forwards, text)
+        SELECT (i % $1) + 1, i,
+               now()::timestamp - (random() * $3 || ' days')::interval,
+               (random() * 20000)::int, (random() * 300)::int, (random() * 100)::int,
+               'Синтетический пост номер ' || i
+        FROM generate_series(1, $2) AS i
+    ''', channels_count, posts_count, history_days)
+    await conn.execute('ANALYZE')
+
+
+async def measure(conn, label, repeats):
+    """Планы и медианное время каждого запроса"""
+    params = {
+        'week_ago': datetime.now() - timedelta(days=7),
+        'min_subscribers': 100,
+        'user_id': 42,
+    }
+    timings = {}
+    print(f"\n========== {label} ==========")
+    for name, (sql, param) in QUERIES.items():
+        value = params[param]
+        plan = await conn.fetch(f'EXPLAIN (ANALYZE, BUFFERS) {sql}', value)
+        print(f"\n--- {name} ---")
+        for row in plan:
+            print(row[0])
+
+        samples = []
+        for _ in range(repeats):
+            started = time.perf_counter()
+            await conn.fetch(sql, value)
+            samples.append((time.perf_counter() - started) * 1000)
+        timings[name] = statistics.median(samples)
+    return timings
+
+
+async def main():
+    load_dotenv()
+    args = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    args.add_argument('--channels', type=int, default=2000)
+    args.add_argument('--posts', type=int, default=1_000_000)
+    args.add_argument('--days', type=int, default=365, help='глубина истории постов')
+    args.add_argument('--repeats', type=int, default=5)
+    opts = args.parse_args()
+
+    database_url = os.getenv("DATABASE_URL")
+    if not database_url:
+        raise SystemExit("❌ DATABASE_URL не найден в переменных окружения!")
+
+    admin = await asyncpg.connect(database_url)
+    await admin.execute(f'DROP SCHEMA IF EXISTS {SCHEMA} CASCADE')
+    await admin.execute(f'CREATE SCHEMA {SCHEMA}')
+
+    db = database.Database()
+    db.pool = await asyncpg.create_pool(
+        database_url, min_size=1, max_size=2, command_timeout=None,
+        server_settings={'search_path': SCHEMA}
+    )
+    try:
+        await db.create_tables()
+        async with db.pool.acquire() as conn:
+            await seed(conn, opts.channels, opts.posts, opts.days)
+            before = await measure(conn, 'ДО МИГРАЦИЙ', opts.repeats)
+
+        await db.run_migrations(target=INDEXES_MIGRATION)
+        async with db.pool.acquire() as conn:
+            await conn.execute('ANALYZE')
+            after = await measure(conn, 'ПОСЛЕ МИГРАЦИЙ', opts.repeats)
+
+        print("\n========== ИТОГ (медиана, мс) ==========")
+        print(f"{'запрос':<22}{'до':>10}{'после':>10}{'ускорение':>12}")
+        for name in QUERIES:
+            speedup = before[name] / after[name] if after[name] else float('inf')
+            print(f"{name:<22}{before[name]:>10.2f}{after[name]:>10.2f}{speedup:>11.1f}x")
+    finally:
+        await db.pool.close()
+        await admin.execute(f'DROP SCHEMA IF EXISTS {SCHEMA} CASCADE')
+        await admin.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,115 @@
+"""
+Бенчмарк записей: словари и кортежи против PostRecord / TopPostRecord.
+
+Часть парсера (без базы): создание N постов словарями и PostRecord -
+пиковая память (tracemalloc) и время.
+Часть базы (если задан DATABASE_URL): разбор строк asyncpg в кортежи по ключам
+и в TopPostRecord(*r) на синтетической выборке generate_series.
+
+    python bench_records.py --posts 100000
+    DATABASE_URL=postgres://... python bench_records.py --rows 100000
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import time
+import tracemalloc
+from datetime import datetime
+
+from dotenv import load_dotenv
+
+from records import PostRecord, TopPostRecord
+
+
+def make_dicts(n, now):
+    return [{
+        'message_id': i,
+        'date': now,
+        'views': i * 3,
+        'reactions': i % 50,
+        'forwards': i % 7,
+        'text': 'текст'
+    } for i in range(n)]
+
+
+def make_records(n, now):
+    return [PostRecord(i, i * 3, i % 50, i % 7, now, 'текст') for i in range(n)]
+
+
+def measure(func, repeats):
+    """Медианное время (мс) и пиковая память (КБ) одного вызова"""
+    samples = []
+    for _ in range(repeats):
+        started = time.perf_counter()
+        func()
+        samples.append((time.perf_counter() - started) * 1000)
+
+    tracemalloc.start()
+    result = func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    return statistics.median(samples), peak / 1024
+
+
+def report(title, results):
+    print(f"\n========== {title} ==========")
+    print(f"{'вариант':<24}{'время, мс':>12}{'пик, КБ':>12}")
+    for name, (elapsed, peak) in results.items():
+        print(f"{name:<24}{elapsed:>12.2f}{peak:>12.0f}")
+
+
+def bench_parser(posts, repeats):
+    now = datetime.now()
+    report(f"ПОСТЫ ПАРСЕРА ({posts})", {
+        'dict': measure(lambda: make_dicts(posts, now), repeats),
+        'PostRecord': measure(lambda: make_records(posts, now), repeats),
+    })
+
+
+async def bench_database(database_url, rows_count, repeats):
+    import asyncpg
+
+    conn = await asyncpg.connect(database_url)
+    try:
+        rows = await conn.fetch('''
+            SELECT i AS channel_id, '@bench_' || i AS username, 'Канал ' || i AS title,
+                   i AS message_id, i * 3 AS value, LOCALTIMESTAMP AS date, 'текст' AS preview
+            FROM generate_series(1, $1) AS i
+        ''', rows_count)
+    finally:
+        await conn.close()
+
+    def as_tuples():
+        return [(r['channel_id'], r['username'], r['title'], r['message_id'],
+                 r['value'], r['date'], r['preview']) for r in rows]
+
+    def as_records():
+        return [TopPostRecord(*r) for r in rows]
+
+    report(f"СТРОКИ ТОПА ({rows_count})", {
+        'кортеж по ключам': measure(as_tuples, repeats),
+        'TopPostRecord(*r)': measure(as_records, repeats),
+    })
+
+
+async def main():
+    load_dotenv()
+    args = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    args.add_argument('--posts', type=int, default=100_000)
+    args.add_argument('--rows', type=int, default=100_000)
+    args.add_argument('--repeats', type=int, default=5)
+    opts = args.parse_args()
+
+    bench_parser(opts.posts, opts.repeats)
+
+    database_url = os.getenv("DATABASE_URL")
+    if database_url:
+        await bench_database(database_url, opts.rows, opts.repeats)
+    else:
+        print("\n⚠️ DATABASE_URL не задан - разбор строк asyncpg пропущен")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -28,3 +28,72 @@ REPORT_CHANNEL_ID = os.getenv("REPORT_CHANNEL_ID")
 # Настройки
 PARSE_INTERVAL = 1800  # 30 минут
 # POSTS_LIMIT больше не используется, удаляем
+
+# Параллельное обновление каналов
+PARSE_WORKERS = int(os.getenv("PARSE_WORKERS", 4))  # одновременно обновляемых каналов
+PARSE_RATE = float(os.getenv("PARSE_RATE", 1.0))  # запросов к Telegram в секунду (на всех воркеров)
+PARSE_BURST = int(os.getenv("PARSE_BURST", 5))  # допустимый всплеск запросов
+
+# Файл сессии Telethon (без расширения), переживает перезапуски
+SESSION_NAME = os.getenv("SESSION_NAME", "parser_session")
+
+# Проверять соединение get_me() только если успешных запросов не было дольше (сек.)
+LIVENESS_PROBE_AFTER = int(os.getenv("LIVENESS_PROBE_AFTER", 120))
+
+# Сколько хранить резолв username -> access_hash (сек.)
+ENTITY_CACHE_TTL = int(os.getenv("ENTITY_CACHE_TTL", 7 * 24 * 3600))
+
+# Флуд-вейты: короткие паузы ждем на месте, при длинных канал откладывается в конец очереди
+FLOOD_MAX_INLINE_WAIT = int(os.getenv("FLOOD_MAX_INLINE_WAIT", 5))
+FLOOD_MAX_REQUEUES = int(os.getenv("FLOOD_MAX_REQUEUES", 3))
+FLOOD_MAX_DEFER = int(os.getenv("FLOOD_MAX_DEFER", 900))  # дольше - канал ждет следующего цикла
+
+# Очередь обновления: активные каналы чаще, молчащие реже
+PARSE_TICK = int(os.getenv("PARSE_TICK", 300))  # как часто проверять, кому пора обновляться
+REFRESH_MIN_INTERVAL = int(os.getenv("REFRESH_MIN_INTERVAL", 600))  # 10 минут
+REFRESH_MAX_INTERVAL = int(os.getenv("REFRESH_MAX_INTERVAL", 6 * 3600))  # 6 часов
+# Подписчики всех каналов - пакетными запросами, отдельно от сбора постов
+SUBSCRIBERS_TICK = int(os.getenv("SUBSCRIBERS_TICK", 1800))
+
+# Задача очереди, которая выполняется дольше (сек.), считается брошенной упавшим воркером
+PARSE_JOB_LEASE = int(os.getenv("PARSE_JOB_LEASE", 3600))
+
+# Где работает парсер: "embedded" - в процессе бота, "worker" - отдельным процессом (python worker.py)
+PARSER_MODE = os.getenv("PARSER_MODE", "embedded")
+
+# Аккаунты парсера: "сессия:api_id:api_hash" через запятую. По умолчанию - один основной аккаунт
+PARSER_ACCOUNTS = []
+for account_str in os.getenv("PARSER_ACCOUNTS", "").split(","):
+    parts = account_str.strip().split(":")
+    if len(parts) == 3:
+        try:
+            PARSER_ACCOUNTS.append({'session_name': parts[0], 'api_id': int(parts[1]), 'api_hash': parts[2]})
+        except ValueError:
+            pass
+if not PARSER_ACCOUNTS:
+    PARSER_ACCOUNTS.append({'session_name': SESSION_NAME, 'api_id': API_ID, 'api_hash': API_HASH})
+
+# Хранилище состояний диалогов: "postgres" (переживает перезапуск, общее для нескольких копий бота),
+# "redis" (любой сервер с протоколом Redis по REDIS_URL) или "memory"
+FSM_STORAGE = os.getenv("FSM_STORAGE", "postgres")
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+FSM_TTL = int(os.getenv("FSM_TTL", 24 * 3600))  # через сколько секунд незаконченный диалог забывается
+
+# "preview" - у постов хранятся только превью и хэш текста,
+# "full" - еще и полный текст в post_texts (его показывает карточка поста)
+POST_TEXT_MODE = os.getenv("POST_TEXT_MODE", "preview")
+
+# posts разбит на недельные партиции: сколько недель создавать наперед и сколько дней хранить (0 - вечно)
+POSTS_PARTITIONS_AHEAD = int(os.getenv("POSTS_PARTITIONS_AHEAD", 4))
+POSTS_RETENTION_DAYS = int(os.getenv("POSTS_RETENTION_DAYS", 365))
+# "drop" - удалять старые партиции, "detach" - отсоединять и оставлять отдельными таблицами
+POSTS_RETENTION_ACTION = os.getenv("POSTS_RETENTION_ACTION", "drop")
+
+# subscribers_history: сколько дней держать ежедневные точки и сколько - недельные сводки (дальше - месячные).
+# Рост за 7/30 дней считается по ежедневным точкам, поэтому их меньше 35 дней не бывает
+SUBSCRIBERS_DAILY_DAYS = max(int(os.getenv("SUBSCRIBERS_DAILY_DAYS", 90)), 35)
+SUBSCRIBERS_WEEKLY_DAYS = int(os.getenv("SUBSCRIBERS_WEEKLY_DAYS", 365))
+
+# Ряды метрик постов: сколько дней хранить и за какое окно считать скорость набора просмотров
+POST_SERIES_DAYS = int(os.getenv("POST_SERIES_DAYS", 7))
+TRENDING_WINDOW_HOURS = int(os.getenv("TRENDING_WINDOW_HOURS", 6))
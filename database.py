@@ -4,10 +4,303 @@ import asyncio
 from datetime import datetime, timedelta
 from typing import List, Tuple, Optional
 
+import config
+from records import (PostRecord, TopPostRecord, ChannelRecord, ChannelGrowthRecord,
+                     ChannelRefRecord, PendingChannelRecord, ChannelSummaryRecord, HorizonGrowthRecord,
+                     RefreshStatsRecord, ChannelEntityRecord, ChannelPeerRecord, ParseJobRecord)
+from previews import make_preview, text_hash
+
+# Дописать в ряд метрик строки CTE written: первая точка дня - база, дальше только смещения и приращения
+SERIES_APPEND_SQL = '''
+    INSERT INTO post_metrics_series AS s
+        (channel_id, message_id, day, base_at, base_views, base_reactions, base_forwards,
+         offsets, views_deltas, reactions_deltas, forwards_deltas, last_views, last_reactions, last_forwards)
+    SELECT channel_id, message_id, CURRENT_DATE, LOCALTIMESTAMP, views, reactions, forwards,
+           ARRAY[]::int[], ARRAY[]::int[], ARRAY[]::int[], ARRAY[]::int[], views, reactions, forwards
+    FROM written
+    ON CONFLICT (channel_id, message_id, day) DO UPDATE SET
+        offsets = s.offsets || extract(epoch FROM LOCALTIMESTAMP - s.base_at)::int,
+        views_deltas = s.views_deltas || (EXCLUDED.last_views - s.last_views),
+        reactions_deltas = s.reactions_deltas || (EXCLUDED.last_reactions - s.last_reactions),
+        forwards_deltas = s.forwards_deltas || (EXCLUDED.last_forwards - s.last_forwards),
+        last_views = EXCLUDED.last_views,
+        last_reactions = EXCLUDED.last_reactions,
+        last_forwards = EXCLUDED.last_forwards
+'''
+
+# Слияние сводки с уже сохраненной за тот же период: min/max по обеим, last - по более поздней точке
+ROLLUP_MERGE_SQL = '''
+    ON CONFLICT (channel_id, period, period_start) DO UPDATE SET
+        min_subscribers = LEAST(subscribers_rollup.min_subscribers, EXCLUDED.min_subscribers),
+        max_subscribers = GREATEST(subscribers_rollup.max_subscribers, EXCLUDED.max_subscribers),
+        last_subscribers = CASE WHEN EXCLUDED.last_date >= subscribers_rollup.last_date
+                                THEN EXCLUDED.last_subscribers ELSE subscribers_rollup.last_subscribers END,
+        last_date = GREATEST(subscribers_rollup.last_date, EXCLUDED.last_date)
+'''
+
+# Ближайший снимок подписчиков не позже 7 и 30 дней от последнего (CTE snapshot -> base)
+GROWTH_BASE_SQL = '''
+    base AS (
+        SELECT s.channel_id, s.subscribers,
+            (SELECT h.subscribers FROM subscribers_history h
+             WHERE h.channel_id = s.channel_id AND h.date <= s.date - 7
+             ORDER BY h.date DESC LIMIT 1) AS week_old,
+            (SELECT h.subscribers FROM subscribers_history h
+             WHERE h.channel_id = s.channel_id AND h.date <= s.date - 30
+             ORDER BY h.date DESC LIMIT 1) AS month_old
+        FROM snapshot s
+    )
+'''
+
+# Версионированные миграции схемы: (версия, описание, [SQL]).
+# Новые изменения схемы добавляются только в конец списка.
+MIGRATIONS = [
+    (1, 'channels.last_message_id для инкрементального сбора', [
+        'ALTER TABLE channels ADD COLUMN IF NOT EXISTS last_message_id INTEGER DEFAULT 0',
+    ]),
+    (2, 'Индексы для топов и выборок каналов', [
+        'CREATE INDEX IF NOT EXISTS idx_posts_date ON posts (date)',
+        'CREATE INDEX IF NOT EXISTS idx_posts_channel_date ON posts (channel_id, date)',
+        'CREATE INDEX IF NOT EXISTS idx_channels_status_subscribers ON channels (status, subscribers)',
+        'CREATE INDEX IF NOT EXISTS idx_channels_added_by ON channels (added_by)',
+    ]),
+    (3, 'Снимки топов, пересобираемые после цикла парсера', [
+        '''
+        CREATE TABLE IF NOT EXISTS leaderboard_posts (
+            board TEXT,
+            rank INTEGER,
+            channel_id INTEGER,
+            username TEXT,
+            title TEXT,
+            message_id INTEGER,
+            value INTEGER,
+            date TIMESTAMP,
+            text TEXT,
+            PRIMARY KEY (board, rank)
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS leaderboard_channels (
+            board TEXT,
+            rank INTEGER,
+            channel_id INTEGER,
+            username TEXT,
+            title TEXT,
+            subscribers INTEGER,
+            growth_7d REAL,
+            growth_30d REAL,
+            PRIMARY KEY (board, rank)
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS leaderboard_generations (
+            board TEXT PRIMARY KEY,
+            generated_at TIMESTAMP NOT NULL
+        )
+        ''',
+    ]),
+    (4, 'Состояние задач планировщика', [
+        '''
+        CREATE TABLE IF NOT EXISTS scheduler_runs (
+            job TEXT PRIMARY KEY,
+            last_run TIMESTAMPTZ NOT NULL,
+            last_duration REAL DEFAULT 0
+        )
+        ''',
+    ]),
+    (5, 'Очередь обновления каналов по приоритету', [
+        '''
+        CREATE TABLE IF NOT EXISTS channel_refresh (
+            channel_id INTEGER PRIMARY KEY REFERENCES channels(id) ON DELETE CASCADE,
+            next_due_at TIMESTAMP NOT NULL,
+            interval_seconds INTEGER NOT NULL,
+            last_refreshed_at TIMESTAMP
+        )
+        ''',
+        'CREATE INDEX IF NOT EXISTS idx_channel_refresh_due ON channel_refresh (next_due_at)',
+    ]),
+    (6, 'Очередь задач для воркера парсера', [
+        '''
+        CREATE TABLE IF NOT EXISTS parse_jobs (
+            id SERIAL PRIMARY KEY,
+            kind TEXT NOT NULL,
+            channel_id INTEGER REFERENCES channels(id) ON DELETE CASCADE,
+            requested_by BIGINT,
+            status TEXT DEFAULT 'queued',
+            result TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            started_at TIMESTAMP,
+            finished_at TIMESTAMP
+        )
+        ''',
+        'CREATE INDEX IF NOT EXISTS idx_parse_jobs_status ON parse_jobs (status, id)',
+    ]),
+    (7, 'Резолв каналов отдельно для каждого аккаунта парсера', [
+        # access_hash у каждого аккаунта свой - старый кэш просто резолвится заново
+        'DELETE FROM channel_entities',
+        "ALTER TABLE channel_entities ADD COLUMN IF NOT EXISTS account TEXT NOT NULL DEFAULT ''",
+        'ALTER TABLE channel_entities DROP CONSTRAINT IF EXISTS channel_entities_pkey',
+        'ALTER TABLE channel_entities ADD PRIMARY KEY (username, account)',
+    ]),
+    (8, 'Превью и хэш текста вместо полного текста в posts', [
+        "ALTER TABLE posts ADD COLUMN IF NOT EXISTS text_preview TEXT DEFAULT ''",
+        'ALTER TABLE posts ADD COLUMN IF NOT EXISTS text_hash BYTEA',
+        # То же, что make_preview(): 15 слов, многоточие, экранирование Markdown
+        r'''
+        UPDATE posts p SET
+            text_hash = decode(md5(p.text), 'hex'),
+            text_preview = regexp_replace(
+                array_to_string(w.words[1:15], ' ') || CASE WHEN cardinality(w.words) > 15 THEN '...' ELSE '' END,
+                '([_*\[\]()~`>#+=|{}.!-])', '\\\1', 'g')
+        FROM (
+            SELECT id, regexp_split_to_array(regexp_replace(text, '^\s+|\s+$', '', 'g'), '\s+') AS words
+            FROM posts
+            WHERE text ~ '\S'
+        ) w
+        WHERE w.id = p.id
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS post_texts (
+            channel_id INTEGER REFERENCES channels(id) ON DELETE CASCADE,
+            message_id INTEGER,
+            text TEXT NOT NULL,
+            PRIMARY KEY (channel_id, message_id)
+        )
+        ''',
+        r'''
+        INSERT INTO post_texts (channel_id, message_id, text)
+        SELECT channel_id, message_id, text FROM posts
+        WHERE text ~ '\S'
+        ON CONFLICT DO NOTHING
+        ''',
+        'ALTER TABLE posts DROP COLUMN IF EXISTS text',
+        'ALTER TABLE leaderboard_posts RENAME COLUMN text TO preview',
+    ]),
+    (9, 'posts с разбиением по неделям', [
+        'ALTER TABLE posts RENAME TO posts_unpartitioned',
+        # Последовательность id переживет удаление старой таблицы
+        'ALTER SEQUENCE posts_id_seq OWNED BY NONE',
+        '''
+        CREATE TABLE posts (
+            id INTEGER NOT NULL DEFAULT nextval('posts_id_seq'),
+            channel_id INTEGER REFERENCES channels(id) ON DELETE CASCADE,
+            message_id INTEGER,
+            date TIMESTAMP NOT NULL,
+            views INTEGER DEFAULT 0,
+            reactions INTEGER DEFAULT 0,
+            forwards INTEGER DEFAULT 0,
+            text_preview TEXT DEFAULT '',
+            text_hash BYTEA,
+            PRIMARY KEY (channel_id, message_id, date)
+        ) PARTITION BY RANGE (date)
+        ''',
+        # История ложится в posts_default, по неделям ее разносит ensure_post_partitions при подключении
+        'CREATE TABLE posts_default PARTITION OF posts DEFAULT',
+        '''
+        INSERT INTO posts (id, channel_id, message_id, date, views, reactions, forwards, text_preview, text_hash)
+        SELECT id, channel_id, message_id, date, views, reactions, forwards, text_preview, text_hash
+        FROM posts_unpartitioned
+        WHERE date IS NOT NULL
+        ''',
+        'DROP TABLE posts_unpartitioned',
+        'ALTER SEQUENCE posts_id_seq OWNED BY posts.id',
+        'CREATE INDEX IF NOT EXISTS idx_posts_date ON posts (date)',
+        'CREATE INDEX IF NOT EXISTS idx_posts_channel_date ON posts (channel_id, date)',
+    ]),
+    (10, 'Недельные и месячные сводки подписчиков', [
+        '''
+        CREATE TABLE IF NOT EXISTS subscribers_rollup (
+            channel_id INTEGER REFERENCES channels(id) ON DELETE CASCADE,
+            period TEXT NOT NULL,
+            period_start DATE NOT NULL,
+            min_subscribers INTEGER NOT NULL,
+            max_subscribers INTEGER NOT NULL,
+            last_subscribers INTEGER NOT NULL,
+            last_date DATE NOT NULL,
+            PRIMARY KEY (channel_id, period, period_start)
+        )
+        ''',
+        'CREATE INDEX IF NOT EXISTS idx_subscribers_rollup_last ON subscribers_rollup (channel_id, last_date)',
+    ]),
+    (11, 'Ряды метрик постов для топа набирающих популярность', [
+        '''
+        CREATE TABLE IF NOT EXISTS post_metrics_series (
+            channel_id INTEGER REFERENCES channels(id) ON DELETE CASCADE,
+            message_id INTEGER,
+            day DATE NOT NULL,
+            base_at TIMESTAMP NOT NULL,
+            base_views INTEGER NOT NULL,
+            base_reactions INTEGER NOT NULL,
+            base_forwards INTEGER NOT NULL,
+            offsets INTEGER[] NOT NULL,
+            views_deltas INTEGER[] NOT NULL,
+            reactions_deltas INTEGER[] NOT NULL,
+            forwards_deltas INTEGER[] NOT NULL,
+            last_views INTEGER NOT NULL,
+            last_reactions INTEGER NOT NULL,
+            last_forwards INTEGER NOT NULL,
+            PRIMARY KEY (channel_id, message_id, day)
+        )
+        ''',
+        'CREATE INDEX IF NOT EXISTS idx_post_metrics_series_day ON post_metrics_series (day)',
+    ]),
+    (12, 'Состояния диалогов бота (FSM)', [
+        '''
+        CREATE UNLOGGED TABLE IF NOT EXISTS fsm_storage (
+            key TEXT PRIMARY KEY,
+            state TEXT,
+            data TEXT,
+            expires_at TIMESTAMP NOT NULL
+        )
+        ''',
+        'CREATE INDEX IF NOT EXISTS idx_fsm_storage_expires ON fsm_storage (expires_at)',
+    ]),
+    (13, 'Счетчик неудачных обновлений канала для паузы перед повтором', [
+        'ALTER TABLE channel_refresh ADD COLUMN IF NOT EXISTS failures INTEGER NOT NULL DEFAULT 0',
+    ]),
+]
+
+# Топы постов: доска -> (колонка метрики, дополнительное условие)
+POST_BOARDS = {
+    'reactions': ('reactions', ''),
+    'views': ('views', ''),
+    'forwards': ('forwards', ''),
+    'small': ('views', 'AND c.subscribers < 3000'),
+}
+
+# Топ постов по скорости набора просмотров (из рядов метрик)
+TRENDING_BOARD = 'trending'
+
+# Топы каналов: доска -> колонка сортировки
+CHANNEL_BOARDS = {
+    'growth_7d': 'growth_7d',
+    'growth_30d': 'growth_30d',
+}
+
+# Сколько позиций хранить в каждом снимке топа
+LEADERBOARD_SIZE = 20
+
+# Колонки channels в порядке полей ChannelRecord
+CHANNEL_COLUMNS = ', '.join(ChannelRecord._fields)
+
+# Ключ advisory-блокировки, чтобы миграции не применялись двумя процессами сразу
+MIGRATIONS_LOCK_ID = 7318001
+
+GROWTH_SET_SQL = '''
+    growth_7d = CASE WHEN b.week_old > 0
+        THEN round(((b.subscribers - b.week_old) * 100.0 / b.week_old)::numeric, 1) ELSE 0 END,
+    growth_30d = CASE WHEN b.month_old > 0
+        THEN round(((b.subscribers - b.month_old) * 100.0 / b.month_old)::numeric, 1) ELSE 0 END
+'''
+
 class Database:
     def __init__(self):
         self.pool = None
         self.connected = False
+        # Отдельное соединение под LISTEN и подписки, которые на нем восстанавливаются
+        self.listen_conn = None
+        self.listeners = {}
+        self.closing = False
     
     async def connect(self, max_retries=3):
         """Подключение к PostgreSQL с повторными попытками"""
@@ -34,6 +327,8 @@ class Database:
                 
                 self.connected = True
                 await self.create_tables()
+                await self.run_migrations()
+                await self.maintain_post_partitions()
                 print("✅ PostgreSQL подключен успешно!")
                 
                 async with self.pool.acquire() as conn:
@@ -103,8 +398,55 @@ class Database:
                 )
             ''')
             
+            # Кэш резолва username -> (id, access_hash), удаляется вместе с каналом
+            await conn.execute('''
+                CREATE TABLE IF NOT EXISTS channel_entities (
+                    username TEXT PRIMARY KEY REFERENCES channels(username) ON DELETE CASCADE,
+                    peer_id BIGINT NOT NULL,
+                    access_hash BIGINT NOT NULL,
+                    resolved_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            ''')
+            
             print("✅ Таблицы созданы/проверены")
     
+    async def run_migrations(self, target: Optional[int] = None) -> int:
+        """Применить недостающие миграции схемы (только до версии target включительно, если задана)"""
+        applied_count = 0
+        async with self.pool.acquire() as conn:
+            await conn.execute('''
+                CREATE TABLE IF NOT EXISTS schema_migrations (
+                    version INTEGER PRIMARY KEY,
+                    name TEXT,
+                    applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            ''')
+            
+            await conn.execute('SELECT pg_advisory_lock($1)', MIGRATIONS_LOCK_ID)
+            try:
+                applied = {r['version'] for r in await conn.fetch('SELECT version FROM schema_migrations')}
+                
+                for version, name, statements in MIGRATIONS:
+                    if version in applied:
+                        continue
+                    if target is not None and version > target:
+                        break
+                    
+                    # Каждая миграция - отдельная транзакция вместе с отметкой о ней
+                    async with conn.transaction():
+                        for statement in statements:
+                            await conn.execute(statement)
+                        await conn.execute('''
+                            INSERT INTO schema_migrations (version, name) VALUES ($1, $2)
+                        ''', version, name)
+                    
+                    applied_count += 1
+                    print(f"🧱 Применена миграция {version}: {name}")
+            finally:
+                await conn.execute('SELECT pg_advisory_unlock($1)', MIGRATIONS_LOCK_ID)
+        
+        return applied_count
+    
     async def add_channel(self, username: str, title: str, added_by: int) -> bool:
         """Добавить канал на модерацию"""
         try:
@@ -156,7 +498,7 @@ class Database:
             print(f"❌ Ошибка удаления: {e}")
             return False
     
-    async def get_pending_channels(self) -> List[Tuple]:
+    async def get_pending_channels(self) -> List[PendingChannelRecord]:
         """Получить каналы на модерации"""
         async with self.pool.acquire() as conn:
             rows = await conn.fetch('''
@@ -165,9 +507,9 @@ class Database:
                 WHERE status = 'pending'
                 ORDER BY created_at DESC
             ''')
-            return [(r['id'], r['username'], r['title'], r['added_by'], r['created_at']) for r in rows]
+            return [PendingChannelRecord(*r) for r in rows]
     
-    async def get_all_approved_channels(self) -> List[Tuple]:
+    async def get_all_approved_channels(self) -> List[ChannelRefRecord]:
         """Все одобренные каналы"""
         async with self.pool.acquire() as conn:
             rows = await conn.fetch('''
@@ -175,9 +517,74 @@ class Database:
                 WHERE status = 'approved'
                 ORDER BY created_at DESC
             ''')
-            return [(r['id'], r['username'], r['title']) for r in rows]
+            return [ChannelRefRecord(*r) for r in rows]
+    
+    async def get_due_channels(self) -> List[ChannelRefRecord]:
+        """Одобренные каналы, которым пора обновляться (новые - первыми)"""
+        async with self.pool.acquire() as conn:
+            rows = await conn.fetch('''
+                SELECT c.id, c.username, c.title
+                FROM channels c
+                LEFT JOIN channel_refresh r ON r.channel_id = c.id
+                WHERE c.status = 'approved'
+                AND (r.next_due_at IS NULL OR r.next_due_at <= LOCALTIMESTAMP)
+                ORDER BY r.next_due_at NULLS FIRST
+            ''')
+            return [ChannelRefRecord(*r) for r in rows]
+    
+    async def get_refresh_stats(self, channel_ids: List[int]) -> List[RefreshStatsRecord]:
+        """Активность каналов: постов за 7 дней, просмотры свежих постов за 48ч, рост за 7 дней"""
+        async with self.pool.acquire() as conn:
+            rows = await conn.fetch('''
+                SELECT c.id,
+                    (SELECT COUNT(*) FROM posts p
+                     WHERE p.channel_id = c.id AND p.date >= LOCALTIMESTAMP - INTERVAL '7 days') AS posts_7d,
+                    (SELECT COALESCE(SUM(p.views), 0) FROM posts p
+                     WHERE p.channel_id = c.id AND p.date >= LOCALTIMESTAMP - INTERVAL '48 hours') AS fresh_views,
+                    c.growth_7d
+                FROM channels c
+                WHERE c.id = ANY($1::int[])
+            ''', channel_ids)
+            return [RefreshStatsRecord(*r) for r in rows]
+    
+    async def schedule_refresh(self, intervals: List[Tuple[int, int]]):
+        """Назначить следующее обновление каналов: [(channel_id, интервал в секундах)]"""
+        if not intervals:
+            return
+        try:
+            async with self.pool.acquire() as conn:
+                await conn.execute('''
+                    INSERT INTO channel_refresh (channel_id, next_due_at, interval_seconds, last_refreshed_at)
+                    SELECT t.channel_id, LOCALTIMESTAMP + make_interval(secs => t.seconds), t.seconds, LOCALTIMESTAMP
+                    FROM unnest($1::int[], $2::int[]) AS t(channel_id, seconds)
+                    ON CONFLICT (channel_id) DO UPDATE
+                    SET next_due_at = EXCLUDED.next_due_at,
+                        interval_seconds = EXCLUDED.interval_seconds,
+                        last_refreshed_at = EXCLUDED.last_refreshed_at,
+                        failures = 0
+                ''', [i[0] for i in intervals], [i[1] for i in intervals])
+        except Exception as e:
+            print(f"❌ Ошибка планирования обновлений: {e}")
     
-    async def get_all_channels(self) -> List[Tuple]:
+    async def schedule_failed_refresh(self, channel_ids: List[int], base: int, limit: int):
+        """Отложить каналы с ошибкой обновления: пауза base * 2^(ошибок подряд), не больше limit"""
+        if not channel_ids:
+            return
+        try:
+            async with self.pool.acquire() as conn:
+                await conn.execute('''
+                    INSERT INTO channel_refresh (channel_id, next_due_at, interval_seconds, failures)
+                    SELECT t.channel_id, LOCALTIMESTAMP + make_interval(secs => $2), $2, 1
+                    FROM unnest($1::int[]) AS t(channel_id)
+                    ON CONFLICT (channel_id) DO UPDATE
+                    SET failures = channel_refresh.failures + 1,
+                        next_due_at = LOCALTIMESTAMP + make_interval(
+                            secs => LEAST($2::float8 * power(2, LEAST(channel_refresh.failures, 20)), $3))
+                ''', channel_ids, base, limit)
+        except Exception as e:
+            print(f"❌ Ошибка планирования повторов: {e}")
+    
+    async def get_all_channels(self) -> List[ChannelSummaryRecord]:
         """Все каналы (для админа)"""
         async with self.pool.acquire() as conn:
             rows = await conn.fetch('''
@@ -185,200 +592,751 @@ class Database:
                 FROM channels 
                 ORDER BY created_at DESC
             ''')
-            return [(r['id'], r['username'], r['title'], r['status'], r['subscribers']) for r in rows]
+            return [ChannelSummaryRecord(*r) for r in rows]
     
     async def update_channel_stats(self, channel_id: int, subscribers: int) -> Tuple[float, float]:
-        """Обновить статистику канала"""
+        """Обновить статистику канала (история + рост одним запросом)"""
         try:
             async with self.pool.acquire() as conn:
                 now = datetime.now().date()
                 
-                await conn.execute('''
-                    INSERT INTO subscribers_history (channel_id, date, subscribers)
-                    VALUES ($1, $2, $3)
-                    ON CONFLICT (channel_id, date) DO UPDATE SET subscribers = $3
+                row = await conn.fetchrow(f'''
+                    WITH snapshot AS (
+                        INSERT INTO subscribers_history (channel_id, date, subscribers)
+                        VALUES ($1, $2, $3)
+                        ON CONFLICT (channel_id, date) DO UPDATE SET subscribers = EXCLUDED.subscribers
+                        RETURNING channel_id, date, subscribers
+                    ),
+                    {GROWTH_BASE_SQL}
+                    UPDATE channels c
+                    SET subscribers = b.subscribers, {GROWTH_SET_SQL}, updated_at = CURRENT_TIMESTAMP
+                    FROM base b
+                    WHERE c.id = b.channel_id
+                    RETURNING c.growth_7d, c.growth_30d
                 ''', channel_id, now, subscribers)
                 
-                week_ago = now - timedelta(days=7)
-                week_old = await conn.fetchval('''
-                    SELECT subscribers FROM subscribers_history 
-                    WHERE channel_id=$1 AND date=$2
-                ''', channel_id, week_ago)
-                
-                growth_7d = 0
-                if week_old and week_old > 0:
-                    growth_7d = round(((subscribers - week_old) / week_old) * 100, 1)
-                
-                month_ago = now - timedelta(days=30)
-                month_old = await conn.fetchval('''
-                    SELECT subscribers FROM subscribers_history 
-                    WHERE channel_id=$1 AND date=$2
-                ''', channel_id, month_ago)
-                
-                growth_30d = 0
-                if month_old and month_old > 0:
-                    growth_30d = round(((subscribers - month_old) / month_old) * 100, 1)
-                
-                await conn.execute('''
-                    UPDATE channels 
-                    SET subscribers=$1, growth_7d=$2, growth_30d=$3, updated_at=CURRENT_TIMESTAMP
-                    WHERE id=$4
-                ''', subscribers, growth_7d, growth_30d, channel_id)
-                
-                return growth_7d, growth_30d
+                if not row:
+                    return 0, 0
+                return round(row['growth_7d'], 1), round(row['growth_30d'], 1)
                 
         except Exception as e:
             print(f"❌ Ошибка обновления статистики: {e}")
             return 0, 0
     
-    async def add_post(self, channel_id: int, message_id: int, date, views=0, reactions=0, forwards=0, text='') -> bool:
-        """Добавить или обновить пост"""
+    async def update_subscribers_bulk(self, counts: List[Tuple[int, int]]) -> int:
+        """Записать подписчиков многих каналов (история + рост) одним запросом"""
+        if not counts:
+            return 0
         try:
             async with self.pool.acquire() as conn:
-                # ИСПРАВЛЕНО: Приводим дату к правильному формату
-                if isinstance(date, str):
-                    from dateutil import parser
-                    date = parser.parse(date)
-                
-                # ИСПРАВЛЕНО: Убираем часовой пояс если есть
-                if hasattr(date, 'tzinfo') and date.tzinfo is not None:
-                    date = date.replace(tzinfo=None)
-                
-                await conn.execute('''
-                    INSERT INTO posts (channel_id, message_id, date, views, reactions, forwards, text)
-                    VALUES ($1, $2, $3, $4, $5, $6, $7)
-                    ON CONFLICT (channel_id, message_id) DO UPDATE 
-                    SET views=$4, reactions=$5, forwards=$6, text=$7
-                ''', channel_id, message_id, date, views, reactions, forwards, text)
-                return True
+                result = await conn.execute(f'''
+                    WITH snapshot AS (
+                        INSERT INTO subscribers_history (channel_id, date, subscribers)
+                        SELECT channel_id, $1, subscribers
+                        FROM unnest($2::int[], $3::int[]) AS n(channel_id, subscribers)
+                        ON CONFLICT (channel_id, date) DO UPDATE SET subscribers = EXCLUDED.subscribers
+                        RETURNING channel_id, date, subscribers
+                    ),
+                    {GROWTH_BASE_SQL}
+                    UPDATE channels c
+                    SET subscribers = b.subscribers, {GROWTH_SET_SQL}, updated_at = CURRENT_TIMESTAMP
+                    FROM base b
+                    WHERE c.id = b.channel_id
+                ''', datetime.now().date(), [c[0] for c in counts], [c[1] for c in counts])
+                return int(result.split()[-1])
         except Exception as e:
-            print(f"❌ Ошибка добавления поста: {e}")
-            return False
+            print(f"❌ Ошибка пакетного обновления подписчиков: {e}")
+            return 0
+    
+    async def refresh_growth(self) -> int:
+        """Пересчитать рост всех одобренных каналов одним запросом"""
+        try:
+            async with self.pool.acquire() as conn:
+                result = await conn.execute(f'''
+                    WITH snapshot AS (
+                        SELECT DISTINCT ON (h.channel_id) h.channel_id, h.date, h.subscribers
+                        FROM subscribers_history h
+                        JOIN channels c ON c.id = h.channel_id
+                        WHERE c.status = 'approved'
+                        ORDER BY h.channel_id, h.date DESC
+                    ),
+                    {GROWTH_BASE_SQL}
+                    UPDATE channels c
+                    SET {GROWTH_SET_SQL}
+                    FROM base b
+                    WHERE c.id = b.channel_id
+                ''')
+                return int(result.split()[-1])
+        except Exception as e:
+            print(f"❌ Ошибка пересчета роста: {e}")
+            return 0
+    
+    async def compact_subscribers_history(self) -> Tuple[int, int]:
+        """Свернуть старые ежедневные точки в недельные сводки, старые недели - в месячные: (дней, недель)"""
+        today = datetime.now().date()
+        daily_cutoff = today - timedelta(days=config.SUBSCRIBERS_DAILY_DAYS)
+        weekly_cutoff = today - timedelta(days=max(config.SUBSCRIBERS_WEEKLY_DAYS, config.SUBSCRIBERS_DAILY_DAYS))
+        try:
+            async with self.pool.acquire() as conn:
+                async with conn.transaction():
+                    await conn.execute(f'''
+                        INSERT INTO subscribers_rollup
+                            (channel_id, period, period_start, min_subscribers, max_subscribers, last_subscribers, last_date)
+                        SELECT channel_id, 'week', date_trunc('week', date)::date,
+                               min(subscribers), max(subscribers),
+                               (array_agg(subscribers ORDER BY date DESC))[1], max(date)
+                        FROM subscribers_history
+                        WHERE date < $1
+                        GROUP BY channel_id, date_trunc('week', date)
+                        {ROLLUP_MERGE_SQL}
+                    ''', daily_cutoff)
+                    days = await conn.execute('DELETE FROM subscribers_history WHERE date < $1', daily_cutoff)
+                    
+                    # Неделя относится к месяцу, в котором она началась
+                    await conn.execute(f'''
+                        INSERT INTO subscribers_rollup
+                            (channel_id, period, period_start, min_subscribers, max_subscribers, last_subscribers, last_date)
+                        SELECT channel_id, 'month', date_trunc('month', period_start)::date,
+                               min(min_subscribers), max(max_subscribers),
+                               (array_agg(last_subscribers ORDER BY last_date DESC))[1], max(last_date)
+                        FROM subscribers_rollup
+                        WHERE period = 'week' AND period_start < $1
+                        GROUP BY channel_id, date_trunc('month', period_start)
+                        {ROLLUP_MERGE_SQL}
+                    ''', weekly_cutoff)
+                    weeks = await conn.execute('''
+                        DELETE FROM subscribers_rollup WHERE period = 'week' AND period_start < $1
+                    ''', weekly_cutoff)
+            
+            compacted = int(days.split()[-1]), int(weeks.split()[-1])
+            if any(compacted):
+                print(f"🗜️ История подписчиков свернута: дней {compacted[0]}, недель {compacted[1]}")
+            return compacted
+        except Exception as e:
+            print(f"❌ Ошибка свертки истории подписчиков: {e}")
+            return 0, 0
+    
+    async def prune_post_metrics_series(self) -> int:
+        """Удалить ряды метрик старше POST_SERIES_DAYS дней"""
+        try:
+            async with self.pool.acquire() as conn:
+                result = await conn.execute('''
+                    DELETE FROM post_metrics_series WHERE day < CURRENT_DATE - $1::int
+                ''', config.POST_SERIES_DAYS)
+                return int(result.split()[-1])
+        except Exception as e:
+            print(f"❌ Ошибка очистки рядов метрик: {e}")
+            return 0
+    
+    async def get_growth(self, days: int, channel_ids: List[int] = None) -> List[HorizonGrowthRecord]:
+        """
+        Рост каналов за произвольный горизонт (90 дней, год...).
+        Точка отсчета - последняя известная не позже горизонта: ежедневная или из сводки.
+        Каналы без такой точки в результат не попадают.
+        """
+        horizon = datetime.now().date() - timedelta(days=days)
+        async with self.pool.acquire() as conn:
+            rows = await conn.fetch('''
+                SELECT c.id, c.subscribers, old.subscribers AS old_subscribers
+                FROM channels c
+                CROSS JOIN LATERAL (
+                    SELECT subscribers FROM (
+                        (SELECT h.date, h.subscribers FROM subscribers_history h
+                         WHERE h.channel_id = c.id AND h.date <= $1
+                         ORDER BY h.date DESC LIMIT 1)
+                        UNION ALL
+                        (SELECT r.last_date, r.last_subscribers FROM subscribers_rollup r
+                         WHERE r.channel_id = c.id AND r.last_date <= $1
+                         ORDER BY r.last_date DESC LIMIT 1)
+                    ) points
+                    ORDER BY date DESC
+                    LIMIT 1
+                ) old
+                WHERE CASE WHEN $2::int[] IS NULL THEN c.status = 'approved' ELSE c.id = ANY($2::int[]) END
+            ''', horizon, channel_ids)
+        
+        return [HorizonGrowthRecord(r['id'], r['subscribers'], r['old_subscribers'],
+                                    round((r['subscribers'] - r['old_subscribers']) * 100.0 / r['old_subscribers'], 1)
+                                    if r['old_subscribers'] else 0)
+                for r in rows]
+    
+    async def upsert_posts(self, channel_id: int, posts: List[PostRecord]) -> Optional[Tuple[int, int, int]]:
+        """Записать пачку постов канала одной транзакцией: (добавлено, обновлено, без изменений)"""
+        if not posts:
+            return 0, 0, 0
+        
+        store_text = config.POST_TEXT_MODE == 'full'
+        records = []
+        for post in posts:
+            date = post.date
+            if date is not None and date.tzinfo is not None:
+                date = date.replace(tzinfo=None)
+            text = post.text or ''
+            records.append((channel_id, post.message_id, date, post.views or 0,
+                            post.reactions or 0, post.forwards or 0,
+                            make_preview(text), text_hash(text), text if store_text else None))
+        
+        try:
+            async with self.pool.acquire() as conn:
+                async with conn.transaction():
+                    # Временная таблица живет в соединении пула и очищается на коммите
+                    await conn.execute('''
+                        CREATE TEMP TABLE IF NOT EXISTS posts_incoming (
+                            channel_id INTEGER,
+                            message_id INTEGER,
+                            date TIMESTAMP,
+                            views INTEGER,
+                            reactions INTEGER,
+                            forwards INTEGER,
+                            text_preview TEXT,
+                            text_hash BYTEA,
+                            text TEXT
+                        ) ON COMMIT DELETE ROWS
+                    ''')
+                    await conn.copy_records_to_table(
+                        'posts_incoming',
+                        records=records,
+                        columns=['channel_id', 'message_id', 'date', 'views', 'reactions', 'forwards',
+                                 'text_preview', 'text_hash', 'text']
+                    )
+                    if store_text:
+                        # Полный текст пишем, только если он изменился (хэш сверяется до обновления posts)
+                        await conn.execute('''
+                            INSERT INTO post_texts (channel_id, message_id, text)
+                            SELECT DISTINCT ON (i.message_id) i.channel_id, i.message_id, i.text
+                            FROM posts_incoming i
+                            LEFT JOIN posts p ON p.channel_id = i.channel_id AND p.message_id = i.message_id
+                                AND p.date = i.date
+                            WHERE i.text <> '' AND p.text_hash IS DISTINCT FROM i.text_hash
+                            ORDER BY i.message_id
+                            ON CONFLICT (channel_id, message_id) DO UPDATE SET text=EXCLUDED.text
+                        ''')
+                    # Переписанные строки сразу дописываются в ряды метрик той же транзакцией
+                    rows = await conn.fetch(f'''
+                        WITH written AS (
+                        INSERT INTO posts (channel_id, message_id, date, views, reactions, forwards,
+                                           text_preview, text_hash)
+                        SELECT DISTINCT ON (message_id) channel_id, message_id, date, views, reactions, forwards,
+                               text_preview, text_hash
+                        FROM posts_incoming
+                        ORDER BY message_id
+                        ON CONFLICT (channel_id, message_id, date) DO UPDATE
+                        SET views=EXCLUDED.views, reactions=EXCLUDED.reactions, forwards=EXCLUDED.forwards,
+                            text_preview=EXCLUDED.text_preview, text_hash=EXCLUDED.text_hash
+                        -- Неизменившуюся строку не переписываем: ни мертвой версии, ни записи в WAL
+                        WHERE (posts.views, posts.reactions, posts.forwards, posts.text_hash)
+                            IS DISTINCT FROM (EXCLUDED.views, EXCLUDED.reactions, EXCLUDED.forwards, EXCLUDED.text_hash)
+                        RETURNING channel_id, message_id, views, reactions, forwards, (xmax = 0) AS inserted
+                        ),
+                        series AS ({SERIES_APPEND_SQL})
+                        SELECT inserted FROM written
+                    ''')
+            
+            inserted = sum(1 for r in rows if r['inserted'])
+            unchanged = len({post.message_id for post in posts}) - len(rows)
+            return inserted, len(rows) - inserted, unchanged
+        except Exception as e:
+            print(f"❌ Ошибка пакетной записи постов: {e}")
+            return None
+    
+    async def update_post_metrics(self, channel_id: int, metrics: List[PostRecord]) -> Tuple[int, int]:
+        """Обновить метрики уже сохраненных постов, если они изменились: (обновлено, без изменений)"""
+        # Без даты пост не найти в партициях posts - такие строки пропускаем
+        undated = [m.message_id for m in metrics if m.date is None]
+        if undated:
+            print(f"⚠️ Метрики без даты пропущены (канал {channel_id}): {undated}")
+            metrics = [m for m in metrics if m.date is not None]
+        if not metrics:
+            return 0, 0
+        try:
+            dates = [m.date.replace(tzinfo=None) for m in metrics]
+            async with self.pool.acquire() as conn:
+                # Условие по дате отсекает партиции старше самого раннего поста пачки
+                changed = await conn.fetchval(f'''
+                    WITH written AS (
+                        UPDATE posts p SET views=m.views, reactions=m.reactions, forwards=m.forwards
+                        FROM unnest($2::int[], $3::timestamp[], $4::int[], $5::int[], $6::int[])
+                            AS m(message_id, date, views, reactions, forwards)
+                        WHERE p.channel_id=$1 AND p.message_id=m.message_id AND p.date=m.date AND p.date >= $7
+                          AND (p.views, p.reactions, p.forwards) IS DISTINCT FROM (m.views, m.reactions, m.forwards)
+                        RETURNING p.channel_id, p.message_id, p.views, p.reactions, p.forwards
+                    ),
+                    series AS ({SERIES_APPEND_SQL})
+                    SELECT COUNT(*) FROM written
+                ''', channel_id,
+                    [m.message_id for m in metrics], dates, [m.views for m in metrics],
+                    [m.reactions for m in metrics], [m.forwards for m in metrics], min(dates))
+            return changed, len(metrics) - changed
+        except Exception as e:
+            print(f"❌ Ошибка обновления метрик: {e}")
+            return 0, 0
+    
+    async def get_post_partitions(self, conn) -> set:
+        """Имена партиций posts"""
+        return {r['relname'] for r in await conn.fetch('''
+            SELECT c.relname FROM pg_inherits i
+            JOIN pg_class c ON c.oid = i.inhrelid
+            WHERE i.inhparent = 'posts'::regclass
+        ''')}
+    
+    async def ensure_post_partitions(self, conn) -> int:
+        """
+        Недельные партиции posts: на строки из posts_default и на POSTS_PARTITIONS_AHEAD недель вперед.
+        Вызывается под блокировкой MIGRATIONS_LOCK_ID из maintain_post_partitions.
+        """
+        names = await self.get_post_partitions(conn)
+        
+        today = datetime.now().date()
+        this_week = today - timedelta(days=today.weekday())
+        first_week = this_week
+        oldest = await conn.fetchval('SELECT min(date) FROM posts_default')
+        if oldest:
+            first_week = min(first_week, oldest.date() - timedelta(days=oldest.weekday()))
+        if config.POSTS_RETENTION_DAYS > 0:
+            # Недели за сроком хранения не создаем - их строки удалит maintain_post_partitions
+            cutoff = today - timedelta(days=config.POSTS_RETENTION_DAYS)
+            first_week = max(first_week, min(this_week, cutoff - timedelta(days=cutoff.weekday())))
+        last_week = this_week + timedelta(weeks=config.POSTS_PARTITIONS_AHEAD)
+        
+        created = 0
+        start = first_week
+        while start <= last_week:
+            end = start + timedelta(weeks=1)
+            name = f"posts_p{start.strftime('%Y%m%d')}"
+            if name not in names:
+                # Строки этой недели могли уже попасть в posts_default - переносим их перед присоединением
+                async with conn.transaction():
+                    await conn.execute(f'CREATE TABLE {name} (LIKE posts INCLUDING DEFAULTS INCLUDING CONSTRAINTS)')
+                    await conn.execute(f'''
+                        WITH moved AS (
+                            DELETE FROM posts_default WHERE date >= $1 AND date < $2 RETURNING *
+                        )
+                        INSERT INTO {name} SELECT * FROM moved
+                    ''', start, end)
+                    await conn.execute(f"ALTER TABLE posts ATTACH PARTITION {name} FOR VALUES FROM ('{start}') TO ('{end}')")
+                created += 1
+            start = end
+        return created
+    
+    async def maintain_post_partitions(self) -> Tuple[int, int]:
+        """Создать недельные партиции posts и убрать вышедшие за срок хранения: (создано, убрано)"""
+        try:
+            async with self.pool.acquire() as conn:
+                # Бот и воркер стартуют одновременно - DDL партиций выполняет один из них, второй ждет
+                await conn.execute('SELECT pg_advisory_lock($1)', MIGRATIONS_LOCK_ID)
+                try:
+                    created = await self.ensure_post_partitions(conn)
+                    
+                    removed = 0
+                    if config.POSTS_RETENTION_DAYS > 0:
+                        names = await self.get_post_partitions(conn)
+                        cutoff = datetime.now().date() - timedelta(days=config.POSTS_RETENTION_DAYS)
+                        for name in sorted(names):
+                            try:
+                                start = datetime.strptime(name, 'posts_p%Y%m%d').date()
+                            except ValueError:
+                                continue
+                            if start + timedelta(weeks=1) > cutoff:
+                                continue
+                            if config.POSTS_RETENTION_ACTION == 'detach':
+                                await conn.execute(f'ALTER TABLE posts DETACH PARTITION {name}')
+                            else:
+                                await conn.execute(f'DROP TABLE {name}')
+                            removed += 1
+                        await conn.execute('DELETE FROM posts_default WHERE date < $1', cutoff)
+                finally:
+                    await conn.execute('SELECT pg_advisory_unlock($1)', MIGRATIONS_LOCK_ID)
+            
+            if created or removed:
+                print(f"🗂️ Партиции posts: создано {created}, убрано {removed}")
+            return created, removed
+        except Exception as e:
+            print(f"❌ Ошибка обслуживания партиций posts: {e}")
+            return 0, 0
+    
+    async def get_recent_message_ids(self, channel_id: int, since) -> List[int]:
+        """ID постов канала, опубликованных после since"""
+        async with self.pool.acquire() as conn:
+            rows = await conn.fetch('''
+                SELECT message_id FROM posts
+                WHERE channel_id=$1 AND date >= $2
+                ORDER BY message_id DESC
+            ''', channel_id, since)
+            return [r['message_id'] for r in rows]
+    
+    async def get_last_message_id(self, channel_id: int) -> int:
+        """Последнее собранное сообщение канала"""
+        async with self.pool.acquire() as conn:
+            result = await conn.fetchval('''
+                SELECT last_message_id FROM channels WHERE id=$1
+            ''', channel_id)
+            return result or 0
+    
+    async def set_last_message_id(self, channel_id: int, message_id: int):
+        """Сдвинуть отметку последнего собранного сообщения"""
+        async with self.pool.acquire() as conn:
+            await conn.execute('''
+                UPDATE channels SET last_message_id = GREATEST(COALESCE(last_message_id, 0), $2)
+                WHERE id=$1
+            ''', channel_id, message_id)
+    
+    async def get_post_preview(self, channel_id: int, message_id: int) -> str:
+        """Получить сохраненное превью поста"""
+        async with self.pool.acquire() as conn:
+            result = await conn.fetchval('''
+                SELECT text_preview FROM posts 
+                WHERE channel_id=$1 AND message_id=$2
+            ''', channel_id, message_id)
+            return result or ''
     
     async def get_post_text(self, channel_id: int, message_id: int) -> str:
-        """Получить текст поста"""
+        """Получить полный текст поста (есть только в режиме POST_TEXT_MODE=full)"""
         async with self.pool.acquire() as conn:
             result = await conn.fetchval('''
-                SELECT text FROM posts 
+                SELECT text FROM post_texts 
                 WHERE channel_id=$1 AND message_id=$2
             ''', channel_id, message_id)
             return result or ''
     
-    # ========== ТОПЫ ==========
+    async def get_channel_entity(self, username: str, account: str = '') -> Optional[ChannelEntityRecord]:
+        """Закэшированный резолв канала аккаунтом"""
+        async with self.pool.acquire() as conn:
+            row = await conn.fetchrow('''
+                SELECT peer_id, access_hash, resolved_at FROM channel_entities
+                WHERE username=$1 AND account=$2
+            ''', username, account)
+            return ChannelEntityRecord(*row) if row else None
+    
+    async def save_channel_entity(self, username: str, peer_id: int, access_hash: int, account: str = '') -> bool:
+        """Сохранить резолв канала аккаунтом"""
+        try:
+            async with self.pool.acquire() as conn:
+                # Время резолва - по часам приложения: с ними парсер сравнивает его для ENTITY_CACHE_TTL
+                await conn.execute('''
+                    INSERT INTO channel_entities (username, account, peer_id, access_hash, resolved_at)
+                    VALUES ($1, $4, $2, $3, $5)
+                    ON CONFLICT (username, account) DO UPDATE
+                    SET peer_id=$2, access_hash=$3, resolved_at=$5
+                ''', username, peer_id, access_hash, account, datetime.now())
+                return True
+        except Exception as e:
+            print(f"❌ Ошибка сохранения резолва {username}: {e}")
+            return False
     
-    async def get_top_posts_by_reactions(self, limit=20) -> List[Tuple]:
-        """Топ постов по реакциям за последние 7 дней"""
+    async def get_channel_entities(self, channel_ids: List[int], account: str = '') -> List[ChannelPeerRecord]:
+        """Закэшированные резолвы каналов аккаунтом"""
         async with self.pool.acquire() as conn:
-            week_ago = datetime.now() - timedelta(days=7)
-            
             rows = await conn.fetch('''
-                SELECT p.channel_id, c.username, c.title, p.message_id, p.reactions, p.date, p.text
-                FROM posts p
-                JOIN channels c ON p.channel_id = c.id
-                WHERE c.status='approved' AND p.date >= $1 AND p.reactions > 0
-                ORDER BY p.reactions DESC
-                LIMIT $2
-            ''', week_ago, limit)
-            
-            return [(r['channel_id'], r['username'], r['title'], r['message_id'], 
-                    r['reactions'], r['date'], r['text']) for r in rows]
+                SELECT c.id, e.peer_id, e.access_hash
+                FROM channels c
+                JOIN channel_entities e ON e.username = c.username
+                WHERE c.id = ANY($1::int[]) AND e.account = $2
+            ''', channel_ids, account)
+            return [ChannelPeerRecord(*r) for r in rows]
     
-    async def get_top_posts_by_views(self, limit=20) -> List[Tuple]:
-        """Топ постов по просмотрам за последние 7 дней"""
+    async def invalidate_channel_entity(self, username: str):
+        """Сбросить резолв канала у всех аккаунтов"""
         async with self.pool.acquire() as conn:
-            week_ago = datetime.now() - timedelta(days=7)
+            await conn.execute('DELETE FROM channel_entities WHERE username=$1', username)
+    
+    # ========== СНИМКИ ТОПОВ ==========
+    
+    async def rebuild_leaderboards(self, limit=LEADERBOARD_SIZE) -> Optional[datetime]:
+        """Пересобрать все снимки топов одной транзакцией"""
+        try:
+            async with self.pool.acquire() as conn:
+                async with conn.transaction():
+                    generated_at = await conn.fetchval('SELECT LOCALTIMESTAMP')
+                    week_ago = generated_at - timedelta(days=7)
+                    
+                    for board, (metric, condition) in POST_BOARDS.items():
+                        await conn.execute('DELETE FROM leaderboard_posts WHERE board=$1', board)
+                        await conn.execute(f'''
+                            INSERT INTO leaderboard_posts
+                                (board, rank, channel_id, username, title, message_id, value, date, preview)
+                            SELECT $1, row_number() OVER (ORDER BY p.{metric} DESC, p.id),
+                                   p.channel_id, c.username, c.title, p.message_id, p.{metric}, p.date, p.text_preview
+                            FROM posts p
+                            JOIN channels c ON p.channel_id = c.id
+                            WHERE c.status='approved' AND p.date >= $2 AND p.{metric} > 0 {condition}
+                            ORDER BY p.{metric} DESC, p.id
+                            LIMIT $3
+                        ''', board, week_ago, limit)
+                    
+                    # Скорость - просмотров в час между первой и последней точкой ряда внутри окна
+                    await conn.execute('DELETE FROM leaderboard_posts WHERE board=$1', TRENDING_BOARD)
+                    await conn.execute('''
+                        WITH samples AS (
+                            SELECT channel_id, message_id, base_at AS at, base_views AS views
+                            FROM post_metrics_series
+                            WHERE day >= $4::timestamp::date - 1
+                            UNION ALL
+                            SELECT s.channel_id, s.message_id, s.base_at + make_interval(secs => u.off),
+                                   s.base_views + sum(u.dv) OVER (
+                                       PARTITION BY s.channel_id, s.message_id, s.day ORDER BY u.i)
+                            FROM post_metrics_series s
+                            CROSS JOIN LATERAL unnest(s.offsets, s.views_deltas) WITH ORDINALITY AS u(off, dv, i)
+                            WHERE s.day >= $4::timestamp::date - 1
+                        ),
+                        velocity AS (
+                            SELECT channel_id, message_id,
+                                   round((max(views) - min(views)) * 3600.0
+                                         / extract(epoch FROM max(at) - min(at)))::int AS per_hour
+                            FROM samples
+                            WHERE at >= $4 - make_interval(hours => $5)
+                            GROUP BY channel_id, message_id
+                            HAVING max(at) - min(at) >= INTERVAL '30 minutes'
+                        )
+                        INSERT INTO leaderboard_posts
+                            (board, rank, channel_id, username, title, message_id, value, date, preview)
+                        SELECT $1, row_number() OVER (ORDER BY v.per_hour DESC, p.id),
+                               p.channel_id, c.username, c.title, p.message_id, v.per_hour, p.date, p.text_preview
+                        FROM velocity v
+                        JOIN posts p ON p.channel_id = v.channel_id AND p.message_id = v.message_id AND p.date >= $2
+                        JOIN channels c ON c.id = p.channel_id
+                        WHERE c.status='approved' AND v.per_hour > 0
+                        ORDER BY v.per_hour DESC, p.id
+                        LIMIT $3
+                    ''', TRENDING_BOARD, week_ago, limit, generated_at, config.TRENDING_WINDOW_HOURS)
+                    
+                    for board, column in CHANNEL_BOARDS.items():
+                        await conn.execute('DELETE FROM leaderboard_channels WHERE board=$1', board)
+                        await conn.execute(f'''
+                            INSERT INTO leaderboard_channels
+                                (board, rank, channel_id, username, title, subscribers, growth_7d, growth_30d)
+                            SELECT $1, row_number() OVER (ORDER BY {column} DESC, id),
+                                   id, username, title, subscribers, growth_7d, growth_30d
+                            FROM channels
+                            WHERE status='approved' AND subscribers >= 100
+                            ORDER BY {column} DESC, id
+                            LIMIT $2
+                        ''', board, limit)
+                    
+                    await conn.executemany('''
+                        INSERT INTO leaderboard_generations (board, generated_at) VALUES ($1, $2)
+                        ON CONFLICT (board) DO UPDATE SET generated_at = EXCLUDED.generated_at
+                    ''', [(board, generated_at) for board in list(POST_BOARDS) + [TRENDING_BOARD] + list(CHANNEL_BOARDS)])
+                    
+                    # Бот сбросит кэш ответов после коммита, в каком бы процессе ни шел парсер
+                    await conn.execute("SELECT pg_notify('leaderboards', $1)", generated_at.isoformat())
             
+            print(f"🏁 Топы пересобраны ({generated_at.strftime('%H:%M')})")
+            return generated_at
+        except Exception as e:
+            print(f"❌ Ошибка пересборки топов: {e}")
+            return None
+    
+    async def get_leaderboard_posts(self, board: str, limit=20) -> List[TopPostRecord]:
+        """Снимок топа постов"""
+        async with self.pool.acquire() as conn:
             rows = await conn.fetch('''
-                SELECT p.channel_id, c.username, c.title, p.message_id, p.views, p.date, p.text
-                FROM posts p
-                JOIN channels c ON p.channel_id = c.id
-                WHERE c.status='approved' AND p.date >= $1 AND p.views > 0
-                ORDER BY p.views DESC
-                LIMIT $2
-            ''', week_ago, limit)
-            
-            return [(r['channel_id'], r['username'], r['title'], r['message_id'], 
-                    r['views'], r['date'], r['text']) for r in rows]
+                SELECT channel_id, username, title, message_id, value, date, preview
+                FROM leaderboard_posts
+                WHERE board=$1 AND rank <= $2
+                ORDER BY rank
+            ''', board, limit)
+            return [TopPostRecord(*r) for r in rows]
     
-    async def get_top_posts_by_forwards(self, limit=20) -> List[Tuple]:
-        """Топ постов по репостам за последние 7 дней"""
+    async def get_leaderboard_channels(self, board: str, limit=20) -> List[ChannelGrowthRecord]:
+        """Снимок топа каналов"""
         async with self.pool.acquire() as conn:
-            week_ago = datetime.now() - timedelta(days=7)
-            
             rows = await conn.fetch('''
-                SELECT p.channel_id, c.username, c.title, p.message_id, p.forwards, p.date, p.text
-                FROM posts p
-                JOIN channels c ON p.channel_id = c.id
-                WHERE c.status='approved' AND p.date >= $1 AND p.forwards > 0
-                ORDER BY p.forwards DESC
-                LIMIT $2
-            ''', week_ago, limit)
-            
-            return [(r['channel_id'], r['username'], r['title'], r['message_id'], 
-                    r['forwards'], r['date'], r['text']) for r in rows]
+                SELECT channel_id, username, title, subscribers, growth_7d, growth_30d
+                FROM leaderboard_channels
+                WHERE board=$1 AND rank <= $2
+                ORDER BY rank
+            ''', board, limit)
+            return [ChannelGrowthRecord(*r) for r in rows]
     
-    async def get_top_channels_by_growth(self, period='7d', limit=20) -> List[Tuple]:
-        """Топ каналов по росту"""
+    async def get_leaderboards_snapshot(self, limit=20) -> dict:
+        """Все топы разом из одного согласованного снимка: доска -> строки"""
         async with self.pool.acquire() as conn:
-            if period == '7d':
-                rows = await conn.fetch('''
-                    SELECT id, username, title, subscribers, growth_7d, growth_30d
-                    FROM channels 
-                    WHERE status='approved' AND subscribers >= 100
-                    ORDER BY growth_7d DESC
-                    LIMIT $1
+            async with conn.transaction(isolation='repeatable_read', readonly=True):
+                post_rows = await conn.fetch('''
+                    SELECT board, channel_id, username, title, message_id, value, date, preview
+                    FROM leaderboard_posts
+                    WHERE rank <= $1
+                    ORDER BY board, rank
                 ''', limit)
-            else:
-                rows = await conn.fetch('''
-                    SELECT id, username, title, subscribers, growth_7d, growth_30d
-                    FROM channels 
-                    WHERE status='approved' AND subscribers >= 100
-                    ORDER BY growth_30d DESC
-                    LIMIT $1
+                channel_rows = await conn.fetch('''
+                    SELECT board, channel_id, username, title, subscribers, growth_7d, growth_30d
+                    FROM leaderboard_channels
+                    WHERE rank <= $1
+                    ORDER BY board, rank
                 ''', limit)
-            
-            return [(r['id'], r['username'], r['title'], r['subscribers'], 
-                    r['growth_7d'], r['growth_30d']) for r in rows]
+        
+        snapshot = {board: [] for board in list(POST_BOARDS) + [TRENDING_BOARD] + list(CHANNEL_BOARDS)}
+        for r in post_rows:
+            snapshot.setdefault(r['board'], []).append(TopPostRecord(*r[1:]))
+        for r in channel_rows:
+            snapshot.setdefault(r['board'], []).append(ChannelGrowthRecord(*r[1:]))
+        return snapshot
     
-    async def get_top_posts_small_channels(self, limit=20) -> List[Tuple]:
-        """Топ постов для каналов с менее 3000 подписчиков за последние 7 дней"""
+    async def get_leaderboard_generation(self, board: str) -> Optional[datetime]:
+        """Когда был собран снимок топа"""
         async with self.pool.acquire() as conn:
-            week_ago = datetime.now() - timedelta(days=7)
-            
-            rows = await conn.fetch('''
-                SELECT p.channel_id, c.username, c.title, p.message_id, p.views, p.date, p.text
-                FROM posts p
-                JOIN channels c ON p.channel_id = c.id
-                WHERE c.status='approved' 
-                AND c.subscribers < 3000 
-                AND p.date >= $1 
-                AND p.views > 0
-                ORDER BY p.views DESC
-                LIMIT $2
-            ''', week_ago, limit)
-            
-            return [(r['channel_id'], r['username'], r['title'], r['message_id'], 
-                    r['views'], r['date'], r['text']) for r in rows]
+            return await conn.fetchval('''
+                SELECT generated_at FROM leaderboard_generations WHERE board=$1
+            ''', board)
     
-    async def get_channel(self, channel_id: int) -> Optional[Tuple]:
-        """Получить канал по ID"""
+    # ========== ЗАДАЧИ ВОРКЕРА ==========
+    
+    async def enqueue_parse_job(self, kind: str, channel_id: int = None, requested_by: int = None) -> Optional[int]:
+        """Поставить задачу воркеру парсера"""
+        try:
+            async with self.pool.acquire() as conn:
+                job_id = await conn.fetchval('''
+                    INSERT INTO parse_jobs (kind, channel_id, requested_by)
+                    VALUES ($1, $2, $3)
+                    RETURNING id
+                ''', kind, channel_id, requested_by)
+                await conn.execute("SELECT pg_notify('parse_jobs', $1)", str(job_id))
+                return job_id
+        except Exception as e:
+            print(f"❌ Ошибка постановки задачи: {e}")
+            return None
+    
+    async def claim_parse_job(self) -> Optional[ParseJobRecord]:
+        """Взять следующую задачу"""
+        async with self.pool.acquire() as conn:
+            row = await conn.fetchrow('''
+                UPDATE parse_jobs SET status = 'running', started_at = CURRENT_TIMESTAMP
+                WHERE id = (
+                    SELECT id FROM parse_jobs
+                    WHERE status = 'queued'
+                    ORDER BY id
+                    FOR UPDATE SKIP LOCKED
+                    LIMIT 1
+                )
+                RETURNING id, kind, channel_id, requested_by
+            ''')
+            return ParseJobRecord(*row) if row else None
+    
+    async def finish_parse_job(self, job_id: int, status: str, result: str = ''):
+        """Отметить задачу выполненной"""
+        async with self.pool.acquire() as conn:
+            await conn.execute('''
+                UPDATE parse_jobs SET status = $2, result = $3, finished_at = CURRENT_TIMESTAMP
+                WHERE id = $1
+            ''', job_id, status, result)
+    
+    async def requeue_stale_parse_jobs(self, lease: int) -> int:
+        """Вернуть в очередь задачи, которые выполняются дольше lease секунд (воркер упал)"""
         async with self.pool.acquire() as conn:
-            row = await conn.fetchrow('SELECT * FROM channels WHERE id=$1', channel_id)
-            if row:
-                return (row['id'], row['username'], row['title'], row['description'],
-                       row['added_by'], row['status'], row['subscribers'], row['growth_7d'],
-                       row['growth_30d'], row['created_at'], row['updated_at'])
+            result = await conn.execute('''
+                UPDATE parse_jobs SET status = 'queued', started_at = NULL
+                WHERE status = 'running' AND started_at < CURRENT_TIMESTAMP - make_interval(secs => $1)
+            ''', lease)
+            return int(result.split()[-1])
+    
+    async def listen(self, channel: str, callback):
+        """Подписаться на NOTIFY канала (подписка переживает разрыв соединения)"""
+        self.listeners.setdefault(channel, []).append(callback)
+        if self.listen_conn is None:
+            await self._connect_listener()
+        else:
+            await self.listen_conn.add_listener(channel, callback)
+    
+    async def _connect_listener(self):
+        """Взять соединение под LISTEN и повесить на него все подписки"""
+        conn = await self.pool.acquire()
+        try:
+            conn.add_termination_listener(self._on_listen_terminated)
+            for channel, callbacks in self.listeners.items():
+                for callback in callbacks:
+                    await conn.add_listener(channel, callback)
+        except Exception:
+            await self.pool.release(conn)
+            raise
+        self.listen_conn = conn
+    
+    def _on_listen_terminated(self, conn):
+        """Соединение LISTEN оборвалось - переподключаемся в фоне"""
+        if self.listen_conn is not conn or self.closing:
+            return
+        self.listen_conn = None
+        print("⚠️ Соединение LISTEN потеряно, переподключаюсь...")
+        asyncio.create_task(self._reconnect_listener(conn))
+    
+    async def _reconnect_listener(self, dead_conn, max_delay: int = 60):
+        """Переподключать LISTEN с нарастающей паузой, пока не получится"""
+        try:
+            await self.pool.release(dead_conn)
+        except Exception:
+            pass
+        
+        delay = 1
+        while not self.closing:
+            try:
+                await self._connect_listener()
+                print("✅ Соединение LISTEN восстановлено")
+                break
+            except Exception as e:
+                print(f"❌ Ошибка переподключения LISTEN: {e}, повтор через {delay} сек")
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, max_delay)
+        if self.closing:
+            return
+        
+        # Уведомления за время разрыва потеряны - будим подписчиков один раз
+        for channel, callbacks in self.listeners.items():
+            for callback in callbacks:
+                try:
+                    callback(self.listen_conn, 0, channel, '')
+                except Exception as e:
+                    print(f"❌ Ошибка обработчика {channel}: {e}")
+    
+    # ========== ПЛАНИРОВЩИК ==========
+    
+    async def get_job_last_run(self, job: str) -> Optional[datetime]:
+        """Плановый срок последнего выполнения задачи"""
+        try:
+            async with self.pool.acquire() as conn:
+                return await conn.fetchval('SELECT last_run FROM scheduler_runs WHERE job=$1', job)
+        except Exception as e:
+            print(f"❌ Ошибка чтения состояния задачи {job}: {e}")
             return None
     
-    async def get_channel_by_username(self, username: str) -> Optional[Tuple]:
+    async def claim_job_run(self, job: str, slot: datetime, min_gap: float = 0) -> bool:
+        """
+        Занять срок запуска задачи: успешно, только если прошлый запуск был раньше slot - min_gap.
+        Из нескольких процессов с одним расписанием срок достается одному.
+        """
+        try:
+            async with self.pool.acquire() as conn:
+                claimed = await conn.fetchval('''
+                    INSERT INTO scheduler_runs (job, last_run) VALUES ($1, $2)
+                    ON CONFLICT (job) DO UPDATE SET last_run = EXCLUDED.last_run
+                    WHERE scheduler_runs.last_run < $2 - make_interval(secs => $3)
+                    RETURNING job
+                ''', job, slot, min_gap)
+                return claimed is not None
+        except Exception as e:
+            print(f"❌ Ошибка захвата задачи {job}: {e}")
+            return False
+    
+    async def set_job_last_run(self, job: str, last_run: datetime, duration: float):
+        """Запомнить выполнение задачи"""
+        try:
+            async with self.pool.acquire() as conn:
+                await conn.execute('''
+                    INSERT INTO scheduler_runs (job, last_run, last_duration) VALUES ($1, $2, $3)
+                    ON CONFLICT (job) DO UPDATE SET last_run=$2, last_duration=$3
+                ''', job, last_run, duration)
+        except Exception as e:
+            print(f"❌ Ошибка записи состояния задачи {job}: {e}")
+    
+    async def get_channel(self, channel_id: int) -> Optional[ChannelRecord]:
+        """Получить канал по ID"""
+        async with self.pool.acquire() as conn:
+            row = await conn.fetchrow(f'SELECT {CHANNEL_COLUMNS} FROM channels WHERE id=$1', channel_id)
+            return ChannelRecord(*row) if row else None
+    
+    async def get_channel_by_username(self, username: str) -> Optional[ChannelRecord]:
         """Получить канал по username"""
         async with self.pool.acquire() as conn:
-            row = await conn.fetchrow('SELECT * FROM channels WHERE username=$1', username)
-            if row:
-                return (row['id'], row['username'], row['title'], row['description'],
-                       row['added_by'], row['status'], row['subscribers'], row['growth_7d'],
-                       row['growth_30d'], row['created_at'], row['updated_at'])
-            return None
+            row = await conn.fetchrow(f'SELECT {CHANNEL_COLUMNS} FROM channels WHERE username=$1', username)
+            return ChannelRecord(*row) if row else None
     
     async def get_user_channels_count(self, user_id: int) -> int:
         """Сколько каналов добавил пользователь"""
@@ -399,5 +1357,9 @@ class Database:
     async def close(self):
         """Закрыть соединение"""
         if self.pool:
+            self.closing = True
+            if self.listen_conn:
+                await self.pool.release(self.listen_conn)
+                self.listen_conn = None
             await self.pool.close()
             print("🔌 Соединение с PostgreSQL закрыто")
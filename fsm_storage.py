@@ -0,0 +1,89 @@
+import json
+from typing import Any, Dict, Optional
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, DefaultKeyBuilder, StorageKey, StateType
+from aiogram.fsm.storage.memory import MemoryStorage
+
+import config
+
+
+class PostgresStorage(BaseStorage):
+    """
+    FSM в таблице fsm_storage через пул asyncpg из Database.
+    Таблица UNLOGGED: состояние диалогов не стоит записи в WAL,
+    а после сбоя сервера пользователь просто начнет диалог заново.
+    """
+
+    def __init__(self, db, ttl: int = 24 * 3600):
+        self.db = db
+        self.ttl = ttl
+        self.key_builder = DefaultKeyBuilder(with_bot_id=True, with_destiny=True)
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        if isinstance(state, State):
+            state = state.state
+        async with self.db.pool.acquire() as conn:
+            await conn.execute('''
+                INSERT INTO fsm_storage (key, state, expires_at)
+                VALUES ($1, $2, LOCALTIMESTAMP + make_interval(secs => $3))
+                ON CONFLICT (key) DO UPDATE
+                SET state = EXCLUDED.state, expires_at = EXCLUDED.expires_at
+            ''', self.key_builder.build(key), state, self.ttl)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        async with self.db.pool.acquire() as conn:
+            return await conn.fetchval('''
+                SELECT state FROM fsm_storage WHERE key=$1 AND expires_at > LOCALTIMESTAMP
+            ''', self.key_builder.build(key))
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        async with self.db.pool.acquire() as conn:
+            await conn.execute('''
+                INSERT INTO fsm_storage (key, data, expires_at)
+                VALUES ($1, $2, LOCALTIMESTAMP + make_interval(secs => $3))
+                ON CONFLICT (key) DO UPDATE
+                SET data = EXCLUDED.data, expires_at = EXCLUDED.expires_at
+            ''', self.key_builder.build(key), json.dumps(data), self.ttl)
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        async with self.db.pool.acquire() as conn:
+            data = await conn.fetchval('''
+                SELECT data FROM fsm_storage WHERE key=$1 AND expires_at > LOCALTIMESTAMP
+            ''', self.key_builder.build(key))
+        return json.loads(data) if data else {}
+
+    async def purge_expired(self) -> int:
+        """Удалить истекшие состояния"""
+        try:
+            async with self.db.pool.acquire() as conn:
+                result = await conn.execute('DELETE FROM fsm_storage WHERE expires_at <= LOCALTIMESTAMP')
+                return int(result.split()[-1])
+        except Exception as e:
+            print(f"❌ Ошибка очистки состояний FSM: {e}")
+            return 0
+
+    async def close(self) -> None:
+        # Пул принадлежит Database и закрывается вместе с ней
+        pass
+
+
+def create_storage(db) -> BaseStorage:
+    """Хранилище FSM по config.FSM_STORAGE: postgres, redis или memory"""
+    if config.FSM_STORAGE == "redis":
+        try:
+            from aiogram.fsm.storage.redis import RedisStorage
+        except ImportError:
+            print("⚠️ Для FSM_STORAGE=redis нужен пакет redis, использую PostgreSQL")
+        else:
+            print("🗄️ FSM: Redis")
+            key_builder = DefaultKeyBuilder(with_bot_id=True, with_destiny=True)
+            return RedisStorage.from_url(config.REDIS_URL, key_builder=key_builder,
+                                         state_ttl=config.FSM_TTL, data_ttl=config.FSM_TTL)
+
+    if config.FSM_STORAGE == "memory":
+        print("🗄️ FSM: память процесса")
+        return MemoryStorage()
+
+    print("🗄️ FSM: PostgreSQL")
+    return PostgresStorage(db, ttl=config.FSM_TTL)
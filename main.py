@@ -5,58 +5,46 @@ from aiogram.filters import CommandStart, Command
 from aiogram.types import Message, CallbackQuery
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
-from aiogram.fsm.storage.memory import MemoryStorage
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 from aiogram.enums import ParseMode
+from aiogram.exceptions import TelegramBadRequest, TelegramRetryAfter
 
 import config
 import database
+import fsm_storage
 import parser
+from previews import shorten_preview
+from render_cache import RenderCache
+from ratelimit import TokenBucket
+from scheduler import Scheduler
+from worker import ParserWorker
 import pytz 
 import os
+import time
 
 # ========== ИНИЦИАЛИЗАЦИЯ ==========
 bot = Bot(token=config.BOT_TOKEN)
-storage = MemoryStorage()
+db = database.Database()
+
+# Состояния диалогов живут вне процесса: переживают перезапуск и общие для копий бота
+storage = fsm_storage.create_storage(db)
 dp = Dispatcher(storage=storage)
+telegram_parser = parser.ParserPool()
 
-db = database.Database()
-telegram_parser = parser.TelegramParser()
+# Готовые ответы топов, сбрасываются по NOTIFY после каждого цикла парсера
+render_cache = RenderCache()
 
 # ID канала для отчетов
 REPORT_CHANNEL_ID = config.REPORT_CHANNEL_ID
+REPORT_SEND_ATTEMPTS = 3
+# Telegram допускает ~20 сообщений в минуту в один канал
+report_rate_limiter = TokenBucket(rate=20 / 60, burst=5)
+# Пропущенные из-за перезапуска отчеты досылаем, если опоздали не больше чем на сутки
+REPORTS_MISFIRE_GRACE = 24 * 3600
+# Сколько символов полного текста показывать в карточке поста (лимит сообщения Telegram - 4096)
+POST_TEXT_SHOW_LIMIT = 3500
 
 # ========== ВСПОМОГАТЕЛЬНЫЕ ФУНКЦИИ ==========
-def escape_markdown(text: str) -> str:
-    """Экранирует специальные символы для Markdown"""
-    if not text:
-        return ""
-    special_chars = ['_', '*', '[', ']', '(', ')', '~', '`', '>', '#', '+', '-', '=', '|', '{', '}', '.', '!']
-    for char in special_chars:
-        text = text.replace(char, f'\\{char}')
-    return text
-
-def get_title_from_text(text: str, word_limit: int = 15) -> str:
-    """
-    Берет первые word_limit слов из текста.
-    Слова разделяются пробелами, знаки препинания не считаются отдельными словами.
-    """
-    if not text or not isinstance(text, str) or text.strip() == "":
-        return "Нет текста"
-    
-    words = text.strip().split()
-    
-    if not words:
-        return "Нет текста"
-    
-    first_words = words[:word_limit]
-    title = ' '.join(first_words)
-    
-    if len(words) > word_limit:
-        title += "..."
-    
-    return escape_markdown(title)
-
 def format_number(num: int) -> str:
     """Форматирование чисел (1000 -> 1K)"""
     if num >= 1000000:
@@ -77,9 +65,10 @@ def get_main_menu():
     kb.button(text="🔄 Топ посты по репостам", callback_data="top_forwards")
     kb.button(text="🚀 Топ каналы по росту", callback_data="top_growth")
     kb.button(text="📊 Топ малые каналы (<3K)", callback_data="top_small")
+    kb.button(text="🔥 Набирают популярность", callback_data="top_trending")
     kb.button(text="ℹ️ О проекте", callback_data="about")
     kb.button(text="➕ Добавить канал", callback_data="add_channel")
-    kb.adjust(2, 2, 2, 1)
+    kb.adjust(2, 2, 2, 2)
     return kb.as_markup()
 
 def get_back_menu():
@@ -152,25 +141,28 @@ async def cancel_add_channel(callback: CallbackQuery, state: FSMContext):
     await state.clear()
     await main_menu_handler(callback, state)
 
+async def updated_line(board: str) -> str:
+    """Когда воркер собрал снимок топа"""
+    generated_at = await db.get_leaderboard_generation(board)
+    if not generated_at:
+        return ""
+    return f"🕒 Обновлено: {generated_at.strftime('%d.%m %H:%M')}\n"
+
 # ========== ТОП ПОСТОВ ПО РЕАКЦИЯМ ==========
-@dp.callback_query(F.data == "top_reactions")
-async def top_reactions_handler(callback: CallbackQuery):
-    """Топ постов по реакциям (15 позиций)"""
-    posts = await db.get_top_posts_by_reactions(15)
+async def render_top_reactions():
+    """Отрисовать топ постов по реакциям"""
+    posts = await db.get_leaderboard_posts('reactions', 15)
     
     if not posts:
         text = "📭 Пока нет данных о постах с реакциями.\n\nДобавленные каналы обновляются каждые 30 минут."
-        if callback.message.text != text:
-            await callback.message.edit_text(text, reply_markup=get_main_menu())
-        await callback.answer()
-        return
+        return text, get_main_menu()
     
     text = "🏆 Топ-15 постов по реакциям:\n\n"
     kb = InlineKeyboardBuilder()
     
     for idx, (channel_id, username, title, message_id, reactions, post_date, post_text) in enumerate(posts, 1):
         date_str = post_date.strftime('%d.%m') if hasattr(post_date, 'strftime') else str(post_date)[:10]
-        preview = get_title_from_text(post_text, 7)
+        preview = shorten_preview(post_text, 7)
         
         text += f"{idx}. {title}\n"
         if preview and preview != "Нет текста":
@@ -183,27 +175,31 @@ async def top_reactions_handler(callback: CallbackQuery):
         
         kb.button(text=btn_text, callback_data=f"post_{channel_id}_{message_id}")
     
+    text += await updated_line('reactions')
+    
     kb.button(text="🏠 В меню", callback_data="main_menu")
     kb.adjust(1)
     
-    new_markup = kb.as_markup()
+    return text, kb.as_markup()
+
+@dp.callback_query(F.data == "top_reactions")
+async def top_reactions_handler(callback: CallbackQuery):
+    """Топ постов по реакциям (15 позиций)"""
+    text, new_markup = await render_cache.get_or_render("top_reactions", render_top_reactions)
+    
     if callback.message.text != text or callback.message.reply_markup != new_markup:
         await callback.message.edit_text(text, reply_markup=new_markup)
     
     await callback.answer()
 
 # ========== ТОП ПОСТОВ ПО ПРОСМОТРАМ ==========
-@dp.callback_query(F.data == "top_views")
-async def top_views_handler(callback: CallbackQuery):
-    """Топ постов по просмотрам (15 позиций)"""
-    posts = await db.get_top_posts_by_views(15)
+async def render_top_views():
+    """Отрисовать топ постов по просмотрам"""
+    posts = await db.get_leaderboard_posts('views', 15)
     
     if not posts:
         text = "📭 Пока нет данных о постах с просмотрами.\n\nДобавленные каналы обновляются каждые 30 минут."
-        if callback.message.text != text:
-            await callback.message.edit_text(text, reply_markup=get_main_menu())
-        await callback.answer()
-        return
+        return text, get_main_menu()
     
     text = "🏆 Топ-15 постов по просмотрам:\n\n"
     kb = InlineKeyboardBuilder()
@@ -211,7 +207,7 @@ async def top_views_handler(callback: CallbackQuery):
     for idx, (channel_id, username, title, message_id, views, post_date, post_text) in enumerate(posts, 1):
         date_str = post_date.strftime('%d.%m') if hasattr(post_date, 'strftime') else str(post_date)[:10]
         views_formatted = format_number(views)
-        preview = get_title_from_text(post_text, 7)
+        preview = shorten_preview(post_text, 7)
         
         text += f"{idx}. {title}\n"
         if preview and preview != "Нет текста":
@@ -224,34 +220,38 @@ async def top_views_handler(callback: CallbackQuery):
         
         kb.button(text=btn_text, callback_data=f"post_{channel_id}_{message_id}")
     
+    text += await updated_line('views')
+    
     kb.button(text="🏠 В меню", callback_data="main_menu")
     kb.adjust(1)
     
-    new_markup = kb.as_markup()
+    return text, kb.as_markup()
+
+@dp.callback_query(F.data == "top_views")
+async def top_views_handler(callback: CallbackQuery):
+    """Топ постов по просмотрам (15 позиций)"""
+    text, new_markup = await render_cache.get_or_render("top_views", render_top_views)
+    
     if callback.message.text != text or callback.message.reply_markup != new_markup:
         await callback.message.edit_text(text, reply_markup=new_markup)
     
     await callback.answer()
 
 # ========== ТОП ПОСТОВ ПО РЕПОСТАМ ==========
-@dp.callback_query(F.data == "top_forwards")
-async def top_forwards_handler(callback: CallbackQuery):
-    """Топ постов по репостам (15 позиций)"""
-    posts = await db.get_top_posts_by_forwards(15)
+async def render_top_forwards():
+    """Отрисовать топ постов по репостам"""
+    posts = await db.get_leaderboard_posts('forwards', 15)
     
     if not posts:
         text = "📭 Пока нет данных о постах с репостами.\n\nДобавленные каналы обновляются каждые 30 минут."
-        if callback.message.text != text:
-            await callback.message.edit_text(text, reply_markup=get_main_menu())
-        await callback.answer()
-        return
+        return text, get_main_menu()
     
     text = "🏆 Топ-15 постов по репостам:\n\n"
     kb = InlineKeyboardBuilder()
     
     for idx, (channel_id, username, title, message_id, forwards, post_date, post_text) in enumerate(posts, 1):
         date_str = post_date.strftime('%d.%m') if hasattr(post_date, 'strftime') else str(post_date)[:10]
-        preview = get_title_from_text(post_text, 7)
+        preview = shorten_preview(post_text, 7)
         
         text += f"{idx}. {title}\n"
         if preview and preview != "Нет текста":
@@ -264,10 +264,18 @@ async def top_forwards_handler(callback: CallbackQuery):
         
         kb.button(text=btn_text, callback_data=f"post_{channel_id}_{message_id}")
     
+    text += await updated_line('forwards')
+    
     kb.button(text="🏠 В меню", callback_data="main_menu")
     kb.adjust(1)
     
-    new_markup = kb.as_markup()
+    return text, kb.as_markup()
+
+@dp.callback_query(F.data == "top_forwards")
+async def top_forwards_handler(callback: CallbackQuery):
+    """Топ постов по репостам (15 позиций)"""
+    text, new_markup = await render_cache.get_or_render("top_forwards", render_top_forwards)
+    
     if callback.message.text != text or callback.message.reply_markup != new_markup:
         await callback.message.edit_text(text, reply_markup=new_markup)
     
@@ -282,20 +290,15 @@ async def top_growth_handler(callback: CallbackQuery):
         await callback.message.edit_text(text, reply_markup=get_growth_menu())
     await callback.answer()
 
-@dp.callback_query(F.data.startswith("growth_"))
-async def growth_period_handler(callback: CallbackQuery):
-    """Топ каналов по росту за период (15 позиций)"""
-    period = callback.data.replace("growth_", "")
+async def render_top_growth(period: str):
+    """Отрисовать топ каналов по росту за период"""
     period_text = "7 дней" if period == "7d" else "30 дней"
     
-    channels = await db.get_top_channels_by_growth(period, 15)
+    channels = await db.get_leaderboard_channels(f"growth_{period}", 15)
     
     if not channels:
         text = f"📭 Пока нет данных о росте каналов за {period_text}.\n\nДобавьте каналы и подождите обновления."
-        if callback.message.text != text:
-            await callback.message.edit_text(text, reply_markup=get_main_menu())
-        await callback.answer()
-        return
+        return text, get_main_menu()
     
     text = f"🚀 Топ-15 каналов по росту (за {period_text}):\n\n"
     kb = InlineKeyboardBuilder()
@@ -312,28 +315,35 @@ async def growth_period_handler(callback: CallbackQuery):
         
         kb.button(text=btn_text, callback_data=f"channel_{channel_id}")
     
+    text += await updated_line(f"growth_{period}")
+    
     kb.button(text="📅 Выбрать период", callback_data="top_growth")
     kb.button(text="🏠 В меню", callback_data="main_menu")
     kb.adjust(1)
     
-    new_markup = kb.as_markup()
+    return text, kb.as_markup()
+
+@dp.callback_query(F.data.startswith("growth_"))
+async def growth_period_handler(callback: CallbackQuery):
+    """Топ каналов по росту за период (15 позиций)"""
+    period = callback.data.replace("growth_", "")
+    text, new_markup = await render_cache.get_or_render(
+        f"top_growth_{period}", lambda: render_top_growth(period)
+    )
+    
     if callback.message.text != text or callback.message.reply_markup != new_markup:
         await callback.message.edit_text(text, reply_markup=new_markup)
     
     await callback.answer()
 
 # ========== ТОП МАЛЫЕ КАНАЛЫ (<3000) ==========
-@dp.callback_query(F.data == "top_small")
-async def top_small_channels_handler(callback: CallbackQuery):
-    """Топ постов для каналов с менее 3000 подписчиков"""
-    posts = await db.get_top_posts_small_channels(15)
+async def render_top_small():
+    """Отрисовать топ постов каналов с менее 3000 подписчиков"""
+    posts = await db.get_leaderboard_posts('small', 15)
     
     if not posts:
         text = "📭 Пока нет данных о малых каналах (<3000 подписчиков).\n\nДобавленные каналы обновляются каждые 30 минут."
-        if callback.message.text != text:
-            await callback.message.edit_text(text, reply_markup=get_main_menu())
-        await callback.answer()
-        return
+        return text, get_main_menu()
     
     now = datetime.now()
     weekdays = ["Понедельник", "Вторник", "Среда", "Четверг", "Пятница", "Суббота", "Воскресенье"]
@@ -352,7 +362,7 @@ async def top_small_channels_handler(callback: CallbackQuery):
         views_formatted = format_number(views)
         clean_username = username[1:] if username.startswith('@') else username
         post_link = f"https://t.me/{clean_username}/{message_id}"
-        preview = get_title_from_text(post_text, 7)
+        preview = shorten_preview(post_text, 7)
         
         text += f"{idx}. {title} ({post_link}): «{preview}» — {views_formatted};\n\n"
         
@@ -367,7 +377,60 @@ async def top_small_channels_handler(callback: CallbackQuery):
     kb.button(text="🏠 В меню", callback_data="main_menu")
     kb.adjust(1)
     
-    new_markup = kb.as_markup()
+    return text, kb.as_markup()
+
+@dp.callback_query(F.data == "top_small")
+async def top_small_channels_handler(callback: CallbackQuery):
+    """Топ постов для каналов с менее 3000 подписчиков"""
+    # В тексте есть сегодняшняя дата - она тоже часть ключа
+    text, new_markup = await render_cache.get_or_render(
+        ("top_small", datetime.now().date()), render_top_small
+    )
+    
+    if callback.message.text != text or callback.message.reply_markup != new_markup:
+        await callback.message.edit_text(text, reply_markup=new_markup)
+    
+    await callback.answer()
+
+# ========== НАБИРАЮТ ПОПУЛЯРНОСТЬ ==========
+async def render_top_trending():
+    """Отрисовать топ постов по скорости набора просмотров"""
+    posts = await db.get_leaderboard_posts(database.TRENDING_BOARD, 15)
+    
+    if not posts:
+        text = "📭 Пока нет данных о динамике постов.\n\nСкорость считается по нескольким обновлениям каналов."
+        return text, get_main_menu()
+    
+    text = f"🔥 Набирают популярность (за последние {config.TRENDING_WINDOW_HOURS} ч.):\n\n"
+    kb = InlineKeyboardBuilder()
+    
+    for idx, (channel_id, username, title, message_id, per_hour, post_date, post_text) in enumerate(posts, 1):
+        date_str = post_date.strftime('%d.%m') if hasattr(post_date, 'strftime') else str(post_date)[:10]
+        preview = shorten_preview(post_text, 7)
+        
+        text += f"{idx}. {title}\n"
+        if preview and preview != "Нет текста":
+            text += f"   💬 {preview}\n"
+        text += f"   ⚡ +{format_number(per_hour)} просмотров/час | {date_str}\n"
+        
+        btn_text = f"#{idx} {title[:15]}"
+        if len(title) > 15:
+            btn_text += "..."
+        
+        kb.button(text=btn_text, callback_data=f"post_{channel_id}_{message_id}")
+    
+    text += await updated_line(database.TRENDING_BOARD)
+    
+    kb.button(text="🏠 В меню", callback_data="main_menu")
+    kb.adjust(1)
+    
+    return text, kb.as_markup()
+
+@dp.callback_query(F.data == "top_trending")
+async def top_trending_handler(callback: CallbackQuery):
+    """Топ постов, быстрее всего набирающих просмотры"""
+    text, new_markup = await render_cache.get_or_render("top_trending", render_top_trending)
+    
     if callback.message.text != text or callback.message.reply_markup != new_markup:
         await callback.message.edit_text(text, reply_markup=new_markup)
     
@@ -376,7 +439,7 @@ async def top_small_channels_handler(callback: CallbackQuery):
 # ========== ПРОСМОТР ПОСТА ==========
 @dp.callback_query(F.data.startswith("post_"))
 async def show_post_handler(callback: CallbackQuery):
-    """Показать пост с первыми 10 словами"""
+    """Показать пост: полный текст в режиме POST_TEXT_MODE=full, иначе первые 10 слов"""
     _, channel_id, message_id = callback.data.split("_")
     channel_id = int(channel_id)
     message_id = int(message_id)
@@ -386,17 +449,27 @@ async def show_post_handler(callback: CallbackQuery):
         await callback.answer("❌ Канал не найден")
         return
     
-    username = channel[1]
-    title = channel[2]
-    post_text = await db.get_post_text(channel_id, message_id)
-    preview_text = get_title_from_text(post_text, 10)
+    username = channel.username
+    title = channel.title
+    
+    # Полный текст читается только здесь и только если он хранится
+    post_text = ""
+    if config.POST_TEXT_MODE == "full":
+        post_text = await db.get_post_text(channel_id, message_id)
+    if post_text:
+        if len(post_text) > POST_TEXT_SHOW_LIMIT:
+            post_text = post_text[:POST_TEXT_SHOW_LIMIT] + "..."
+        body = f"📝 Текст поста:\n{post_text}"
+    else:
+        post_preview = await db.get_post_preview(channel_id, message_id)
+        body = f"📝 Смысл поста: {shorten_preview(post_preview, 10)}"
     
     clean_username = username[1:] if username.startswith('@') else username
     link = f"https://t.me/{clean_username}/{message_id}"
     
     await callback.message.answer(
         f"📢 Пост из канала {title}\n\n"
-        f"📝 Смысл поста: {preview_text}\n\n"
+        f"{body}\n\n"
         f"🔗 Ссылка на пост: {link}",
         reply_markup=InlineKeyboardBuilder()
             .button(text="🔗 Открыть пост", url=link)
@@ -419,6 +492,13 @@ async def show_channel_handler(callback: CallbackQuery):
     
     channel_id, username, title, description, added_by, status, subscribers, growth_7d, growth_30d, created_at, updated_at = channel
     
+    # Длинные горизонты считаются по сводкам subscribers_rollup, когда ежедневных точек уже нет
+    long_growth = ""
+    for days, label in ((90, "90 дней"), (365, "год")):
+        growth = await db.get_growth(days, [channel_id])
+        if growth:
+            long_growth += f"\n• Рост за {label}: {growth[0].growth:+.1f}%"
+    
     text = f"""📢 {title}
 
 {description or 'Христианский канал'}
@@ -426,7 +506,7 @@ async def show_channel_handler(callback: CallbackQuery):
 📊 Реальная статистика:
 • Подписчики: {subscribers:,}
 • Рост за 7 дней: {growth_7d:+.1f}%
-• Рост за 30 дней: {growth_30d:+.1f}%
+• Рост за 30 дней: {growth_30d:+.1f}%{long_growth}
 • Обновлено: {updated_at.strftime('%Y-%m-%d %H:%M') if updated_at else 'сегодня'}"""
     
     clean_username = username[1:] if username.startswith('@') else username
@@ -528,7 +608,7 @@ async def process_channel_link(message: Message, state: FSMContext):
     
     existing = await db.get_channel_by_username(username)
     if existing:
-        status = existing[5]
+        status = existing.status
         if status == 'pending':
             await message.answer(
                 f"⏳ Канал {username} уже отправлен на модерацию.",
@@ -576,10 +656,11 @@ async def process_channel_link(message: Message, state: FSMContext):
     await state.clear()
 
 # ========== ФУНКЦИИ ДЛЯ ОТЧЕТОВ (ТОП-15) ==========
-async def generate_reactions_report():
+async def generate_reactions_report(posts=None):
     """Топ-15 постов по реакциям - ЕЖЕНЕДЕЛЬНЫЙ"""
     try:
-        posts = await db.get_top_posts_by_reactions(15)
+        if posts is None:
+            posts = await db.get_leaderboard_posts('reactions', 15)
         if not posts:
             return None
         
@@ -596,7 +677,7 @@ async def generate_reactions_report():
             clean_username = username[1:] if username.startswith('@') else username
             channel_link = f"https://t.me/{clean_username}"
             post_link = f"https://t.me/{clean_username}/{message_id}"
-            post_preview = get_title_from_text(post_text, 15)
+            post_preview = shorten_preview(post_text, 15)
             
             # ИСПРАВЛЕНО: Используем title (название канала) вместо username
             text += f"{idx}. [{title}]({channel_link}) | ❤️ {reactions} | [ПОСТ]({post_link})\n"
@@ -608,10 +689,11 @@ async def generate_reactions_report():
         print(f"Ошибка генерации отчета по реакциям: {e}")
         return None
 
-async def generate_views_report():
+async def generate_views_report(posts=None):
     """Топ-15 постов по просмотрам - ЕЖЕНЕДЕЛЬНЫЙ"""
     try:
-        posts = await db.get_top_posts_by_views(15)
+        if posts is None:
+            posts = await db.get_leaderboard_posts('views', 15)
         if not posts:
             return None
         
@@ -629,7 +711,7 @@ async def generate_views_report():
             channel_link = f"https://t.me/{clean_username}"
             post_link = f"https://t.me/{clean_username}/{message_id}"
             views_formatted = format_number(views)
-            post_preview = get_title_from_text(post_text, 15)
+            post_preview = shorten_preview(post_text, 15)
             
             # ИСПРАВЛЕНО: Используем title (название канала) вместо username
             text += f"{idx}. [{title}]({channel_link}) | 👁️ {views_formatted} | [ПОСТ]({post_link})\n"
@@ -641,10 +723,11 @@ async def generate_views_report():
         print(f"Ошибка генерации отчета по просмотрам: {e}")
         return None
 
-async def generate_forwards_report():
+async def generate_forwards_report(posts=None):
     """Топ-15 постов по репостам - ЕЖЕНЕДЕЛЬНЫЙ"""
     try:
-        posts = await db.get_top_posts_by_forwards(15)
+        if posts is None:
+            posts = await db.get_leaderboard_posts('forwards', 15)
         if not posts:
             return None
         
@@ -661,7 +744,7 @@ async def generate_forwards_report():
             clean_username = username[1:] if username.startswith('@') else username
             channel_link = f"https://t.me/{clean_username}"
             post_link = f"https://t.me/{clean_username}/{message_id}"
-            post_preview = get_title_from_text(post_text, 15)
+            post_preview = shorten_preview(post_text, 15)
             
             # ИСПРАВЛЕНО: Используем title (название канала) вместо username
             text += f"{idx}. [{title}]({channel_link}) | 🔄 {forwards} | [ПОСТ]({post_link})\n"
@@ -673,10 +756,11 @@ async def generate_forwards_report():
         print(f"Ошибка генерации отчета по репостам: {e}")
         return None
 
-async def generate_growth_report():
+async def generate_growth_report(channels=None):
     """Топ-15 каналов по росту - ЕЖЕМЕСЯЧНЫЙ"""
     try:
-        channels = await db.get_top_channels_by_growth('30d', 15)
+        if channels is None:
+            channels = await db.get_leaderboard_channels('growth_30d', 15)
         if not channels:
             return None
         
@@ -703,10 +787,11 @@ async def generate_growth_report():
         print(f"Ошибка генерации отчета по росту: {e}")
         return None
 
-async def generate_small_report():
+async def generate_small_report(posts=None):
     """Топ-15 постов малых каналов - ЕЖЕНЕДЕЛЬНЫЙ"""
     try:
-        posts = await db.get_top_posts_small_channels(15)
+        if posts is None:
+            posts = await db.get_leaderboard_posts('small', 15)
         if not posts:
             return None
         
@@ -724,7 +809,7 @@ async def generate_small_report():
             channel_link = f"https://t.me/{clean_username}"
             post_link = f"https://t.me/{clean_username}/{message_id}"
             views_formatted = format_number(views)
-            post_preview = get_title_from_text(post_text, 15)
+            post_preview = shorten_preview(post_text, 15)
             
             # ИСПРАВЛЕНО: Используем title (название канала) вместо username
             text += f"{idx}. [{title}]({channel_link}) | 👁️ {views_formatted} | [ПОСТ]({post_link})\n"
@@ -736,6 +821,35 @@ async def generate_small_report():
         print(f"Ошибка генерации отчета по малым каналам: {e}")
         return None
 
+async def send_report(report: str, stats: dict):
+    """Отправить отчет с учетом лимитов Telegram и повторами"""
+    for attempt in range(1, REPORT_SEND_ATTEMPTS + 1):
+        stats['attempts'] = attempt
+        await report_rate_limiter.acquire()
+        try:
+            await bot.send_message(REPORT_CHANNEL_ID, report, parse_mode=ParseMode.MARKDOWN)
+            return True
+        except TelegramRetryAfter as e:
+            # Telegram сам говорит, сколько ждать - ждем ровно столько
+            print(f"⏳ Лимит отправки, жду {e.retry_after} сек.")
+            stats['waited'] += e.retry_after
+            await asyncio.sleep(e.retry_after)
+        except TelegramBadRequest as e:
+            print(f"⚠️ Ошибка разметки отчета: {e}")
+            stats['plain'] = True
+            clean_report = report.replace('[', '').replace('](', ' - ').replace(')', '')
+            try:
+                await report_rate_limiter.acquire()
+                await bot.send_message(REPORT_CHANNEL_ID, clean_report)
+                return True
+            except Exception as e:
+                print(f"❌ Ошибка отправки отчета без форматирования: {e}")
+                return False
+        except Exception as e:
+            print(f"❌ Ошибка отправки отчета (попытка {attempt}): {e}")
+            await asyncio.sleep(attempt * 2)
+    return False
+
 async def send_weekly_reports():
     """Отправка всех отчетов"""
     try:
@@ -743,53 +857,51 @@ async def send_weekly_reports():
             print("⚠️ ID канала для отчетов не указан")
             return
         
-        reports = [
-            ("реакциям", await generate_reactions_report()),
-            ("просмотрам", await generate_views_report()),
-            ("репостам", await generate_forwards_report()),
-            ("росту", await generate_growth_report()),
-            ("малым каналам", await generate_small_report())
+        started = time.perf_counter()
+        
+        # Все отчеты строятся из одного согласованного снимка топов
+        snapshot = await db.get_leaderboards_snapshot(15)
+        
+        builders = [
+            ("реакциям", generate_reactions_report, snapshot['reactions']),
+            ("просмотрам", generate_views_report, snapshot['views']),
+            ("репостам", generate_forwards_report, snapshot['forwards']),
+            ("росту", generate_growth_report, snapshot['growth_30d']),
+            ("малым каналам", generate_small_report, snapshot['small'])
         ]
         
+        # Сборка без запросов к базе - строим и сразу отправляем каждый отчет по порядку
+        all_stats = []
         sent_count = 0
-        for name, report in reports:
-            if report:
-                try:
-                    await bot.send_message(REPORT_CHANNEL_ID, report, parse_mode=ParseMode.MARKDOWN)
-                    await asyncio.sleep(2)
-                    sent_count += 1
-                    print(f"✅ Отчет по {name} отправлен")
-                except Exception as e:
-                    print(f"❌ Ошибка отправки отчета по {name}: {e}")
-                    try:
-                        clean_report = report.replace('[', '').replace('](', ' - ').replace(')', '')
-                        await bot.send_message(REPORT_CHANNEL_ID, clean_report)
-                        print(f"✅ Отчет по {name} отправлен без форматирования")
-                    except:
-                        pass
+        for name, generate, data in builders:
+            build_started = time.perf_counter()
+            report = await generate(data)
+            stats = {'name': name, 'build': time.perf_counter() - build_started, 'send': 0.0, 'attempts': 0, 'waited': 0, 'plain': False, 'sent': False}
+            all_stats.append(stats)
+            
+            if not report:
+                continue
+            
+            send_started = time.perf_counter()
+            stats['sent'] = await send_report(report, stats)
+            stats['send'] = time.perf_counter() - send_started
+            
+            if stats['sent']:
+                sent_count += 1
+                suffix = " без форматирования" if stats['plain'] else ""
+                print(f"✅ Отчет по {name} отправлен{suffix}")
+            else:
+                print(f"❌ Отчет по {name} не отправлен")
         
-        print(f"✅ Всего отправлено отчетов: {sent_count}")
+        for stats in all_stats:
+            print(f"   📈 {stats['name']}: сборка {stats['build'] * 1000:.0f} мс, "
+                  f"отправка {stats['send']:.1f} сек., попыток {stats['attempts']}, ожидание лимита {stats['waited']} сек.")
+        print(f"✅ Всего отправлено отчетов: {sent_count} за {time.perf_counter() - started:.1f} сек.")
+        return all_stats
         
     except Exception as e:
         print(f"❌ Ошибка отправки отчетов: {e}")
 
-async def schedule_weekly_reports():
-    """Планировщик еженедельных отчетов"""
-    try:
-        while True:
-            vladivostok_tz = pytz.timezone('Asia/Vladivostok')
-            now = datetime.now(vladivostok_tz)
-            
-            if now.weekday() == 5 and now.hour == 7 and now.minute == 0:
-                print("📅 Суббота 7:00 - отправляю отчеты")
-                await send_weekly_reports()
-                await asyncio.sleep(3600)
-            else:
-                await asyncio.sleep(30)
-                
-    except Exception as e:
-        print(f"❌ Ошибка планировщика: {e}")
-
 # ========== АДМИН ПАНЕЛЬ ==========
 @dp.message(Command("admin"))
 async def admin_handler(message: Message):
@@ -801,7 +913,7 @@ async def admin_handler(message: Message):
     pending = await db.get_pending_channels()
     all_channels = await db.get_all_channels()
     
-    approved_count = len([c for c in all_channels if c[3] == 'approved'])
+    approved_count = len([c for c in all_channels if c.status == 'approved'])
     pending_count = len(pending)
     total_count = len(all_channels)
     
@@ -901,14 +1013,9 @@ async def approve_channel_handler(callback: CallbackQuery):
     channel_id = int(callback.data.replace("approve_", ""))
     
     if await db.approve_channel(channel_id):
-        channel = await db.get_channel(channel_id)
-        if channel:
-            username = channel[1]
-            try:
-                await telegram_parser.connect()
-                await telegram_parser.update_channel_stats(username, db)
-            except Exception as e:
-                print(f"⚠️ Не удалось собрать статистику: {e}")
+        # Статистику соберет воркер парсера
+        if not await db.enqueue_parse_job('refresh_channel', channel_id, callback.from_user.id):
+            print(f"⚠️ Не удалось поставить сбор статистики канала {channel_id}")
         
         await callback.answer("✅ Канал одобрен!", show_alert=True)
         await admin_pending_handler(callback)
@@ -1003,21 +1110,13 @@ async def admin_update_stats_handler(callback: CallbackQuery):
         await callback.answer("❌ Нет прав")
         return
     
-    await callback.answer("🔄 Начинаю обновление...", show_alert=False)
-    
-    try:
-        await telegram_parser.connect()
-        results = await telegram_parser.update_all_channels(db)
-        
-        text = f"✅ Обновлено {len(results)} каналов\n\n"
-        if results:
-            text += "Последние обновления:\n"
-            for result in results[:5]:
-                text += f"• {result['title']}: {result['subscribers']:,} подписчиков\n"
-        
-        await callback.message.answer(text, reply_markup=get_main_menu())
-    except Exception as e:
-        await callback.message.answer(f"❌ Ошибка: {str(e)}", reply_markup=get_main_menu())
+    # Обновление идет в воркере парсера, результат придет отдельным сообщением
+    job_id = await db.enqueue_parse_job('refresh_all', requested_by=callback.from_user.id)
+    if job_id:
+        await callback.answer(f"🔄 Обновление поставлено в очередь (задача #{job_id})", show_alert=False)
+    else:
+        await callback.message.answer("❌ Не удалось поставить обновление в очередь", reply_markup=get_main_menu())
+        await callback.answer()
 
 @dp.callback_query(F.data == "admin_back")
 async def admin_back_handler(callback: CallbackQuery, state: FSMContext):
@@ -1031,7 +1130,7 @@ async def admin_back_handler(callback: CallbackQuery, state: FSMContext):
     pending = await db.get_pending_channels()
     all_channels = await db.get_all_channels()
     
-    approved_count = len([c for c in all_channels if c[3] == 'approved'])
+    approved_count = len([c for c in all_channels if c.status == 'approved'])
     pending_count = len(pending)
     total_count = len(all_channels)
     
@@ -1064,17 +1163,6 @@ async def admin_back_handler(callback: CallbackQuery, state: FSMContext):
     
     await callback.answer()
 
-# ========== АВТООБНОВЛЕНИЕ ==========
-async def scheduled_parser():
-    """Автообновление статистики"""
-    try:
-        if await telegram_parser.connect():
-            print(f"\n⏰ {datetime.now().strftime('%H:%M')} - Автообновление...")
-            results = await telegram_parser.update_all_channels(db)
-            print(f"✅ Обновлено {len(results)} каналов")
-    except Exception as e:
-        print(f"❌ Ошибка автообновления: {e}")
-
 # ========== ЗАПУСК ==========
 async def main():
     print("\n" + "="*60)
@@ -1096,29 +1184,26 @@ async def main():
     print(f"📅 Отчеты: Суббота 7:00 (Владивосток)")
     print("="*60)
     
-    print("\n🔗 Тестирую подключение парсера...")
-    try:
-        if await telegram_parser.connect():
-            print("✅ Парсер подключен!")
-        else:
-            print("⚠️ Парсер не подключен")
-    except Exception as e:
-        print(f"❌ Ошибка парсера: {e}")
+    # Сбрасываем кэш топов, когда воркер пересобрал снимки
+    await db.listen('leaderboards', lambda *args: render_cache.invalidate())
+    
+    # Без отдельного воркера (python worker.py) парсер работает в процессе бота
+    if config.PARSER_MODE == "embedded":
+        asyncio.create_task(ParserWorker(db, telegram_parser, bot).run())
+    else:
+        print("🛠️ Парсер: отдельный воркер (python worker.py)")
     
     print("\n🚀 Запускаю бота...")
     print("✅ Бот запущен!")
     print("="*60)
     
-    async def background_parser():
-        while True:
-            await scheduled_parser()
-            await asyncio.sleep(config.PARSE_INTERVAL)
-    
-    async def background_reports():
-        await schedule_weekly_reports()
-    
-    asyncio.create_task(background_parser())
-    asyncio.create_task(background_reports())
+    # Отчеты - суббота 7:00 по Владивостоку
+    scheduler = Scheduler(db)
+    scheduler.add_cron("weekly_reports", send_weekly_reports, weekday=5, hour=7, minute=0,
+                       misfire_grace=REPORTS_MISFIRE_GRACE)
+    if isinstance(storage, fsm_storage.PostgresStorage):
+        scheduler.add_interval("fsm_purge", storage.purge_expired, 3600)
+    scheduler.start()
     
     try:
         await bot.delete_webhook(drop_pending_updates=True)
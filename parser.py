@@ -1,77 +1,331 @@
 import asyncio
+import bisect
+import hashlib
 import os
+import time
 from datetime import datetime, timedelta
 from telethon import TelegramClient, errors
-from telethon.tl.functions.channels import GetFullChannelRequest
+from telethon.tl.functions.channels import GetChannelsRequest, GetFullChannelRequest
+from telethon.tl.types import InputChannel, InputPeerChannel
 import config
+from ratelimit import TokenBucket
+from records import PostRecord
+
+# Размер страницы iter_messages (один запрос к Telegram)
+MESSAGES_PAGE_SIZE = 100
+# Максимум ID в одном запросе channels.GetMessages
+MESSAGES_IDS_BATCH = 100
+# Каналов в одном запросе channels.GetChannels
+CHANNELS_IDS_BATCH = 100
+# Постов в одной пачке записи и сколько пачек может ждать записи
+POSTS_WRITE_BATCH = 200
+POSTS_QUEUE_BATCHES = 2
+
+# Виртуальных узлов на аккаунт в кольце консистентного хеширования
+HASH_RING_REPLICAS = 100
+# Через сколько секунд снова пробовать неавторизованный/недоступный аккаунт
+SHARD_RETRY_AFTER = 3600
+
+# Аккаунт больше не может работать - его каналы нужно отдать другим
+UNAUTHORIZED_ERRORS = (
+    errors.AuthKeyUnregisteredError,
+    errors.AuthKeyDuplicatedError,
+    errors.SessionRevokedError,
+    errors.SessionExpiredError,
+    errors.UserDeactivatedError,
+    errors.UserDeactivatedBanError,
+)
+
+# Пороги "горячего" канала для очереди обновления
+REFRESH_HOT_VIEWS_PER_HOUR = 100  # просмотров в час у постов за последние 48 часов
+REFRESH_GROWTH_HOT = 5.0  # % роста подписчиков за 7 дней
+
+
+def count_reactions(message) -> int:
+    """Сумма реакций сообщения"""
+    reaction_count = 0
+    if hasattr(message, 'reactions') and message.reactions:
+        if hasattr(message.reactions, 'results'):
+            for reaction in message.reactions.results:
+                reaction_count += reaction.count
+        elif hasattr(message.reactions, 'recent_reactions'):
+            reaction_count = len(message.reactions.recent_reactions)
+    return reaction_count
+
+def refresh_interval(posts_7d: int, fresh_views: int, growth_7d: float) -> int:
+    """Через сколько секунд снова обновлять канал, исходя из его активности"""
+    if posts_7d == 0 and abs(growth_7d or 0) < REFRESH_GROWTH_HOT:
+        # Молчащий канал - редко
+        return config.REFRESH_MAX_INTERVAL
+    
+    # Обновляем примерно дважды между соседними постами
+    interval = 7 * 24 * 3600 / max(posts_7d, 1) / 2
+    
+    # Свежие посты еще набирают просмотры - не реже обычного цикла
+    if fresh_views > 0:
+        interval = min(interval, config.PARSE_INTERVAL)
+    # Быстро набирают - чаще
+    if fresh_views / 48 >= REFRESH_HOT_VIEWS_PER_HOUR:
+        interval = config.REFRESH_MIN_INTERVAL
+    # Быстро растущий канал держим в текущем цикле
+    if abs(growth_7d or 0) >= REFRESH_GROWTH_HOT:
+        interval = min(interval, config.PARSE_INTERVAL)
+    
+    return int(min(max(interval, config.REFRESH_MIN_INTERVAL), config.REFRESH_MAX_INTERVAL))
+
+class ConnectionHealth:
+    """Отслеживает живость соединения по успешным запросам"""
+    
+    def __init__(self, probe_after: float):
+        self.probe_after = probe_after
+        self.last_success = None
+        self.probes = 0
+        self.probes_skipped = 0
+        self.failures = 0
+    
+    def mark_success(self):
+        self.last_success = time.monotonic()
+    
+    def mark_failure(self):
+        self.failures += 1
+        self.last_success = None
+    
+    def needs_probe(self) -> bool:
+        """Проба нужна, только если успешный запрос был давно"""
+        if self.last_success is None:
+            return True
+        return time.monotonic() - self.last_success > self.probe_after
+    
+    def stats(self) -> dict:
+        return {
+            'probes': self.probes,
+            'probes_skipped': self.probes_skipped,
+            'failures': self.failures
+        }
+
+
+class FloodWaitDeferred(Exception):
+    """Метод на паузе из-за флуд-вейта: канал нужно вернуть в очередь позже"""
+    
+    def __init__(self, method: str, seconds: float):
+        super().__init__(f"{method}: флуд-вейт {seconds:.0f} сек.")
+        self.method = method
+        self.seconds = seconds
+
+
+# Ошибки, которые пробрасываются до очереди каналов, а не глушатся на месте
+PROPAGATE_ERRORS = (FloodWaitDeferred,) + UNAUTHORIZED_ERRORS
+
+
+class RequestScheduler:
+    """Планировщик запросов к Telegram с учетом флуд-вейтов по классам методов"""
+    
+    def __init__(self, rate: float, burst: int, max_inline_wait: float):
+        # Общий лимит для всех воркеров
+        self.bucket = TokenBucket(rate, burst)
+        self.max_inline_wait = max_inline_wait
+        # Класс метода -> до какого момента (monotonic) он на паузе
+        self.paused_until = {}
+        # Класс метода -> выученный минимальный интервал между запросами
+        self.spacing = {}
+        # Класс метода -> ближайший свободный слот для запроса
+        self.next_slot = {}
+        self.reset_stats()
+    
+    def reset_stats(self):
+        self.blocked_seconds = 0.0
+        self.flood_waits = {}
+        self.flood_seconds = 0
+    
+    async def acquire(self, method: str):
+        """Дождаться права на запрос; при долгой паузе метода - отложить канал"""
+        now = time.monotonic()
+        pause = self.paused_until.get(method, 0) - now
+        if pause > self.max_inline_wait:
+            raise FloodWaitDeferred(method, pause)
+        
+        # Резервируем слот заранее, чтобы воркеры не шли одним залпом
+        slot = max(now, self.paused_until.get(method, 0), self.next_slot.get(method, 0))
+        self.next_slot[method] = slot + self.spacing.get(method, 0)
+        if slot > now:
+            if pause > 0:
+                self.blocked_seconds += slot - now
+            await asyncio.sleep(slot - now)
+        
+        await self.bucket.acquire()
+    
+    def success(self, method: str):
+        """После успешного запроса понемногу возвращаем темп"""
+        spacing = self.spacing.get(method)
+        if spacing:
+            spacing *= 0.9
+            if spacing < 0.05:
+                self.spacing.pop(method)
+            else:
+                self.spacing[method] = spacing
+    
+    def flood(self, method: str, seconds: int) -> FloodWaitDeferred:
+        """Запомнить флуд-вейт: пауза только для этого класса методов и более редкий темп"""
+        until = time.monotonic() + seconds
+        self.paused_until[method] = max(self.paused_until.get(method, 0), until)
+        self.spacing[method] = min(max(self.spacing.get(method, 0) * 2, 1.0), 60.0)
+        self.flood_waits[method] = self.flood_waits.get(method, 0) + 1
+        self.flood_seconds += seconds
+        print(f"⚠️ Флуд-вейт {method}: {seconds} сек., интервал теперь {self.spacing[method]:.1f} сек.")
+        return FloodWaitDeferred(method, seconds)
+    
+    def longest_pause(self) -> float:
+        """Сколько еще секунд длится самая долгая пауза по методам"""
+        now = time.monotonic()
+        return max([until - now for until in self.paused_until.values()] + [0])
+    
+    def stats(self) -> dict:
+        return {
+            'blocked_seconds': self.blocked_seconds,
+            'flood_seconds': self.flood_seconds,
+            'flood_waits': dict(self.flood_waits),
+            'spacing': dict(self.spacing)
+        }
+
 
 class TelegramParser:
-    def __init__(self):
+    def __init__(self, session_name=None, api_id=None, api_hash=None):
+        self.session_name = session_name or config.SESSION_NAME
+        self.api_id = api_id or config.API_ID
+        self.api_hash = api_hash or config.API_HASH
+        # Аккаунт разлогинен - каналы цикла отдаются другим аккаунтам
+        self.unauthorized = False
         self.client = None
         self.connected = False
+        self.connect_lock = asyncio.Lock()
+        self.health = ConnectionHealth(config.LIVENESS_PROBE_AFTER)
+        # username -> (InputPeerChannel, время резолва)
+        self.entity_cache = {}
+        # Общий лимит запросов и флуд-вейты по классам методов
+        self.requests = RequestScheduler(config.PARSE_RATE, config.PARSE_BURST, config.FLOOD_MAX_INLINE_WAIT)
+        # Сколько строк posts цикл действительно переписал, а сколько пропустил как неизменившиеся
+        self.row_stats = {'changed': 0, 'unchanged': 0}
+        self.last_cycle_stats = {}
     
-    async def connect(self):
-        """Подключение к Telegram"""
-        try:
-            # Закрываем старое соединение если есть
-            if self.client:
-                try:
-                    await self.client.disconnect()
-                except:
-                    pass
-                self.client = None
-            
-            # Удаляем старую сессию
-            session_file = 'parser_session.session'
-            if os.path.exists(session_file):
-                try:
-                    os.remove(session_file)
-                    print("🗑️ Удалена старая сессия")
-                except Exception as e:
-                    print(f"⚠️ Не удалось удалить сессию: {e}")
-            
-            print(f"🔗 Подключаю Telethon...")
-            
-            self.client = TelegramClient(
-                'parser_session',
-                config.API_ID,
-                config.API_HASH,
-                connection_retries=5,
-                timeout=30,
-                device_model="Python Parser",
-                system_version="4.16.30",
-                app_version="1.0"
-            )
+    def _create_client(self):
+        """Создать клиента поверх сохраненной на диске сессии"""
+        return TelegramClient(
+            self.session_name,
+            self.api_id,
+            self.api_hash,
+            connection_retries=5,
+            timeout=30,
+            # Флуд-вейты не пережидаем внутри Telethon - ими управляет RequestScheduler
+            flood_sleep_threshold=0,
+            device_model="Python Parser",
+            system_version="4.16.30",
+            app_version="1.0"
+        )
+    
+    def _drop_session_file(self):
+        """Удалить файл сессии (только если сессия стала недействительной)"""
+        session_file = f"{self.session_name}.session"
+        if os.path.exists(session_file):
+            try:
+                os.remove(session_file)
+                print("🗑️ Удалена недействительная сессия")
+            except Exception as e:
+                print(f"⚠️ Не удалось удалить сессию: {e}")
+    
+    async def connect(self, force=False):
+        """Подключение к Telegram с повторным использованием сессии"""
+        async with self.connect_lock:
+            # Живое соединение переиспользуем, без нового рукопожатия
+            if not force and self.client and self.connected and self.client.is_connected():
+                return True
             
+            try:
+                if self.client is None:
+                    print(f"🔗 Подключаю Telethon (сессия {self.session_name})...")
+                    self.client = self._create_client()
+                elif force:
+                    print("🔄 Переподключаю Telethon...")
+                    try:
+                        await self.client.disconnect()
+                    except:
+                        pass
+                
+                # Ключ авторизации берется из файла сессии, повторный вход не нужен
+                await self.client.connect()
+                if not await self.client.is_user_authorized():
+                    await self.client.start()
+                
+                self.connected = True
+                self.unauthorized = False
+                self.health.mark_success()
+                print("✅ Telethon подключен")
+                return True
+                
+            except (errors.AuthKeyUnregisteredError, errors.AuthKeyDuplicatedError, errors.SessionRevokedError) as e:
+                # Сессия отозвана - только в этом случае начинаем с чистого листа
+                print(f"⚠️ Сессия недействительна: {e}")
+                await self._reset_client()
+                self._drop_session_file()
+                return await self._start_fresh()
+                
+            except Exception as e:
+                print(f"❌ Ошибка подключения Telethon: {e}")
+                self.connected = False
+                return False
+    
+    async def _reset_client(self):
+        if self.client:
+            try:
+                await self.client.disconnect()
+            except:
+                pass
+        self.client = None
+        self.connected = False
+    
+    async def _start_fresh(self):
+        """Новая авторизация после удаления недействительной сессии"""
+        try:
+            self.client = self._create_client()
             await self.client.start()
             self.connected = True
-            print("✅ Telethon подключен")
+            self.health.mark_success()
+            print("✅ Telethon подключен с новой сессией")
             return True
-            
         except Exception as e:
             print(f"❌ Ошибка подключения Telethon: {e}")
             self.connected = False
             return False
     
+    async def reconnect(self):
+        """Переподключение после реального сбоя соединения"""
+        self.connected = False
+        return await self.connect(force=True)
+    
     async def ensure_connected(self):
         """Проверяет подключение и переподключает если нужно"""
         try:
-            if not self.client or not self.connected:
+            if not self.client or not self.connected or not self.client.is_connected():
                 return await self.connect()
             
+            # Недавний успешный запрос уже подтвердил соединение
+            if not self.health.needs_probe():
+                self.health.probes_skipped += 1
+                return True
+            
             # Проверяем, работает ли подключение
             try:
+                self.health.probes += 1
                 await self.client.get_me()
+                self.health.mark_success()
                 return True
             except Exception as e:
                 print(f"⚠️ Потеряно соединение: {e}")
-                self.connected = False
-                return await self.connect()
+                self.health.mark_failure()
+                return await self.reconnect()
                 
         except Exception as e:
             print(f"❌ Ошибка проверки подключения: {e}")
-            self.connected = False
-            return await self.connect()
+            return await self.reconnect()
     
     async def close(self):
         """Закрыть соединение"""
@@ -84,7 +338,53 @@ class TelegramParser:
             self.connected = False
             print("🔌 Telethon отключен")
     
-    async def get_channel_info(self, username):
+    async def _request(self, method, factory):
+        """Выполнить запрос через планировщик запросов"""
+        await self.requests.acquire(method)
+        try:
+            result = await factory()
+        except errors.FloodWaitError as e:
+            raise self.requests.flood(method, e.seconds)
+        self.requests.success(method)
+        self.health.mark_success()
+        return result
+    
+    def _entity_is_fresh(self, resolved_at) -> bool:
+        return resolved_at is not None and datetime.now() - resolved_at < timedelta(seconds=config.ENTITY_CACHE_TTL)
+    
+    async def resolve_entity(self, username, db=None):
+        """Получить InputPeerChannel по username: память -> база -> get_entity"""
+        cached = self.entity_cache.get(username)
+        if cached and self._entity_is_fresh(cached[1]):
+            return cached[0]
+        
+        if db:
+            row = await db.get_channel_entity(username, self.session_name)
+            if row and self._entity_is_fresh(row.resolved_at):
+                peer = InputPeerChannel(row.peer_id, row.access_hash)
+                self.entity_cache[username] = (peer, row.resolved_at)
+                return peer
+        
+        entity = await self._request('resolve', lambda: self.client.get_entity(username))
+        
+        access_hash = getattr(entity, 'access_hash', None)
+        if access_hash is None:
+            # Не канал (пользователь/чат) - кэшировать нечего
+            return entity
+        
+        peer = InputPeerChannel(entity.id, access_hash)
+        self.entity_cache[username] = (peer, datetime.now())
+        if db:
+            await db.save_channel_entity(username, entity.id, access_hash, self.session_name)
+        return peer
+    
+    async def invalidate_entity(self, username, db=None):
+        """Сбросить кэш резолва (канал переименован или удален)"""
+        self.entity_cache.pop(username, None)
+        if db:
+            await db.invalidate_channel_entity(username)
+    
+    async def get_channel_info(self, username, db=None):
         """Получить информацию о канале"""
         try:
             # Проверяем подключение перед каждым запросом
@@ -103,33 +403,41 @@ class TelegramParser:
             print(f"🔍 Получаю данные {username}")
             
             try:
-                entity = await self.client.get_entity(username)
+                entity = await self.resolve_entity(username, db)
+            except PROPAGATE_ERRORS:
+                raise
             except ValueError as e:
                 print(f"❌ Неверный формат username {username}: {e}")
                 return None
             except errors.UsernameNotOccupiedError:
                 print(f"❌ Username {username} не существует")
-                return None
-            except errors.FloodWaitError as e:
-                print(f"⚠️ Флуд-вейт: {e.seconds} секунд")
-                await asyncio.sleep(e.seconds)
+                await self.invalidate_entity(username, db)
                 return None
             except Exception as e:
                 print(f"❌ Ошибка получения entity {username}: {e}")
                 return None
             
             try:
-                full = await self.client(GetFullChannelRequest(channel=entity))
-                subscribers = full.full_chat.participants_count
-            except:
-                subscribers = 0
+                full = await self._request('full_channel', lambda: self.client(GetFullChannelRequest(channel=entity)))
+            except (errors.ChannelInvalidError, errors.ChannelPrivateError) as e:
+                # Закэшированный access_hash больше не действует
+                print(f"❌ Канал {username} недоступен: {e}")
+                await self.invalidate_entity(username, db)
+                return None
+            
+            chat = next((c for c in full.chats if c.id == full.full_chat.id), full.chats[0])
+            
+            # Канал сменил username - при следующем цикле резолвим заново
+            if chat.username and f"@{chat.username}".lower() != username.lower():
+                print(f"⚠️ Канал {username} теперь @{chat.username}")
+                await self.invalidate_entity(username, db)
             
             return {
-                'id': entity.id,
-                'username': entity.username if hasattr(entity, 'username') else username,
-                'title': entity.title,
-                'description': getattr(entity, 'about', ''),
-                'subscribers': subscribers,
+                'id': chat.id,
+                'username': chat.username or username,
+                'title': chat.title,
+                'description': full.full_chat.about or '',
+                'subscribers': full.full_chat.participants_count or 0,
                 'date': datetime.now()
             }
             
@@ -139,18 +447,131 @@ class TelegramParser:
         except errors.ChannelPrivateError:
             print(f"❌ Канал {username} приватный")
             return None
-        except errors.FloodWaitError as e:
-            print(f"⚠️ Флуд-вейт: {e.seconds} секунд")
-            await asyncio.sleep(e.seconds)
-            return None
+        except PROPAGATE_ERRORS:
+            raise
         except Exception as e:
             print(f"❌ Ошибка получения {username}: {e}")
             return None
     
-    async def get_channel_posts_last_week(self, username):
-        """Получить посты из канала за последние 7 дней"""
+    async def iter_channel_posts(self, username, db=None, min_id=0):
+        """Новые посты канала за последние 7 дней (только новее min_id), по одному"""
+        if not await self.ensure_connected():
+            raise ConnectionError("нет подключения к Telegram")
+        
+        if not username.startswith('@'):
+            username = '@' + username
+        
+        entity = await self.resolve_entity(username, db)
+        
+        # Вычисляем дату 7 дней назад (без часового пояса)
+        week_ago = datetime.now() - timedelta(days=7)
+        post_count = 0
+        
+        print(f"📅 Собираю новые посты за последние 7 дней для {username} (после #{min_id})...")
+        
+        try:
+            await self.requests.acquire('history')
+            async for message in self.client.iter_messages(entity, min_id=min_id, reverse=False):
+                if message is None or not hasattr(message, 'id'):
+                    continue
+                
+                # Приводим дату сообщения к naive datetime
+                message_date = message.date.replace(tzinfo=None)
+                
+                if message_date < week_ago:
+                    break
+                
+                post_count += 1
+                # Каждая следующая страница - отдельный запрос к Telegram
+                if post_count % MESSAGES_PAGE_SIZE == 0:
+                    await self.requests.acquire('history')
+                
+                message_text = ""
+                if hasattr(message, 'message') and message.message:
+                    message_text = message.message
+                elif hasattr(message, 'text') and message.text:
+                    message_text = message.text
+                
+                yield PostRecord(
+                    message.id,
+                    getattr(message, 'views', 0) or 0,
+                    count_reactions(message),
+                    getattr(message, 'forwards', 0) or 0,
+                    message_date,
+                    message_text
+                )
+        except errors.FloodWaitError as e:
+            raise self.requests.flood('history', e.seconds)
+        
+        self.requests.success('history')
+        self.health.mark_success()
+        
+        print(f"📊 Собрано {post_count} новых постов за последние 7 дней для {username}")
+    
+    async def ingest_channel_posts(self, username, channel_id, db, min_id=0):
+        """Потоково записать новые посты: Telegram -> очередь пачек -> upsert_posts.
+        
+        Чтение следующей страницы идет одновременно с записью предыдущей пачки,
+        а ограниченная очередь держит в памяти не больше POSTS_QUEUE_BATCHES пачек.
+        Возвращает (добавлено, обновлено, без изменений, максимальный ID) или None, если поток прерван.
+        """
+        queue = asyncio.Queue(maxsize=POSTS_QUEUE_BATCHES)
+        
+        async def produce():
+            batch = []
+            async for post in self.iter_channel_posts(username, db, min_id):
+                batch.append(post)
+                if len(batch) >= POSTS_WRITE_BATCH:
+                    # Запись отстает - ждем здесь, а не копим посты в памяти
+                    await queue.put(batch)
+                    batch = []
+            if batch:
+                await queue.put(batch)
+            await queue.put(None)
+        
+        async def consume():
+            inserted = updated = unchanged = 0
+            max_id = min_id
+            while True:
+                batch = await queue.get()
+                if batch is None:
+                    return inserted, updated, unchanged, max_id
+                written = await db.upsert_posts(channel_id, batch)
+                if written is None:
+                    producer.cancel()
+                    return None
+                inserted += written[0]
+                updated += written[1]
+                unchanged += written[2]
+                max_id = max(max_id, max(post.message_id for post in batch))
+        
+        producer = asyncio.create_task(produce())
+        consumer = asyncio.create_task(consume())
+        try:
+            await asyncio.wait({producer, consumer}, return_when=asyncio.FIRST_EXCEPTION)
+            # Ошибка любой из сторон - настоящая причина; вторую сторону отменит finally
+            for task in (producer, consumer):
+                if task.done() and not task.cancelled() and task.exception():
+                    raise task.exception()
+            return await consumer
+        except PROPAGATE_ERRORS:
+            raise
+        except Exception as e:
+            # Уже записанные пачки безвредны: отметка не сдвинется, и канал перечитается
+            print(f"❌ Ошибка потока постов {username}: {e}")
+            return None
+        finally:
+            for task in (producer, consumer):
+                if not task.done():
+                    task.cancel()
+            await asyncio.gather(producer, consumer, return_exceptions=True)
+    
+    async def refresh_post_metrics(self, username, message_ids, db=None):
+        """Обновить просмотры/реакции/репосты уже известных постов пачками по ID"""
+        if not message_ids:
+            return []
+        
         try:
-            # Проверяем подключение перед каждым запросом
             if not await self.ensure_connected():
                 print(f"❌ Нет подключения к Telegram")
                 return []
@@ -158,73 +579,37 @@ class TelegramParser:
             if not username.startswith('@'):
                 username = '@' + username
             
-            try:
-                entity = await self.client.get_entity(username)
-            except Exception as e:
-                print(f"❌ Не удалось получить entity для {username}: {e}")
-                return []
-            
-            # Вычисляем дату 7 дней назад (без часового пояса)
-            week_ago = datetime.now() - timedelta(days=7)
-            
-            posts = []
-            post_count = 0
-            
-            print(f"📅 Собираю посты за последние 7 дней для {username}...")
+            entity = await self.resolve_entity(username, db)
             
-            try:
-                async for message in self.client.iter_messages(entity, offset_date=datetime.now(), reverse=False):
-                    if message is None or not hasattr(message, 'id'):
+            metrics = []
+            for i in range(0, len(message_ids), MESSAGES_IDS_BATCH):
+                batch = message_ids[i:i + MESSAGES_IDS_BATCH]
+                messages = await self._request('messages', lambda: self.client.get_messages(entity, ids=batch))
+                
+                for message in messages:
+                    # Удаленные сообщения приходят как None
+                    if message is None:
                         continue
-                    
-                    # Приводим дату сообщения к naive datetime
-                    message_date = message.date.replace(tzinfo=None)
-                    
-                    if message_date < week_ago:
-                        break
-                    
-                    post_count += 1
-                    
-                    message_text = ""
-                    if hasattr(message, 'message') and message.message:
-                        message_text = message.message
-                    elif hasattr(message, 'text') and message.text:
-                        message_text = message.text
-                    
-                    reaction_count = 0
-                    if hasattr(message, 'reactions') and message.reactions:
-                        if hasattr(message.reactions, 'results'):
-                            for reaction in message.reactions.results:
-                                reaction_count += reaction.count
-                        elif hasattr(message.reactions, 'recent_reactions'):
-                            reaction_count = len(message.reactions.recent_reactions)
-                    
-                    views = getattr(message, 'views', 0)
-                    forwards = getattr(message, 'forwards', 0)
-                    
-                    posts.append({
-                        'message_id': message.id,
-                        'date': message_date,
-                        'views': views,
-                        'reactions': reaction_count,
-                        'forwards': forwards,
-                        'text': message_text
-                    })
-            except Exception as e:
-                print(f"❌ Ошибка при итерации сообщений {username}: {e}")
-                return []
+                    metrics.append(PostRecord(
+                        message.id,
+                        getattr(message, 'views', 0) or 0,
+                        count_reactions(message),
+                        getattr(message, 'forwards', 0) or 0,
+                        message.date.replace(tzinfo=None)
+                    ))
             
-            print(f"📊 Собрано {post_count} постов за последние 7 дней для {username}")
-            return posts
+            return metrics
             
+        except PROPAGATE_ERRORS:
+            raise
         except Exception as e:
-            print(f"❌ Ошибка постов {username}: {e}")
+            print(f"❌ Ошибка обновления метрик {username}: {e}")
             return []
     
     async def update_channel_stats(self, username, db):
         """Обновить статистику канала"""
         try:
-            info = await self.get_channel_info(username)
+            info = await self.get_channel_info(username, db)
             if not info:
                 return None
             
@@ -233,26 +618,34 @@ class TelegramParser:
                 print(f"❌ Канал {username} не найден в базе")
                 return None
             
-            channel_id = channel[0]
+            channel_id = channel.id
             
             growth_7d, growth_30d = await db.update_channel_stats(channel_id, info['subscribers'])
             
-            posts = await self.get_channel_posts_last_week(username)
+            # Забираем только сообщения новее сохраненной отметки
+            last_message_id = await db.get_last_message_id(channel_id)
+            # Известные посты окна - до потока: новые посты все новее отметки
+            week_ago = datetime.now() - timedelta(days=7)
+            known_ids = [message_id for message_id in await db.get_recent_message_ids(channel_id, week_ago)
+                         if message_id <= last_message_id]
+            
+            written = await self.ingest_channel_posts(username, channel_id, db, min_id=last_message_id)
+            inserted_count, updated_count, unchanged_count, max_id = written or (0, 0, 0, last_message_id)
+            saved_count = inserted_count + updated_count
             
-            saved_count = 0
-            for post in posts:
-                if await db.add_post(
-                    channel_id=channel_id,
-                    message_id=post['message_id'],
-                    date=post['date'],
-                    views=post['views'],
-                    reactions=post['reactions'],
-                    forwards=post['forwards'],
-                    text=post['text']
-                ):
-                    saved_count += 1
+            # Отметку двигаем, только если поток дочитан и записан целиком
+            if max_id > last_message_id:
+                await db.set_last_message_id(channel_id, max_id)
             
-            print(f"✅ Обновлен {username}: {info['subscribers']} подписчиков, сохранено {saved_count} постов за 7 дней")
+            # Метрики уже известных постов окна - пачками по ID
+            metrics = await self.refresh_post_metrics(username, known_ids, db)
+            refreshed_count, same_count = await db.update_post_metrics(channel_id, metrics)
+            
+            self.row_stats['changed'] += inserted_count + updated_count + refreshed_count
+            self.row_stats['unchanged'] += unchanged_count + same_count
+            
+            print(f"✅ Обновлен {username}: {info['subscribers']} подписчиков, постов добавлено {inserted_count}/обновлено {updated_count}, "
+                  f"обновлены метрики {refreshed_count}, без изменений {unchanged_count + same_count}")
             
             return {
                 'username': info['username'],
@@ -263,36 +656,370 @@ class TelegramParser:
                 'growth_30d': growth_30d
             }
             
+        except PROPAGATE_ERRORS:
+            raise
         except Exception as e:
             print(f"❌ Ошибка обновления {username}: {e}")
             return None
     
-    async def update_all_channels(self, db):
-        """Обновить все каналы"""
-        print("🔄 Начинаю обновление всех каналов...")
+    async def refresh_subscribers(self, db, channels):
+        """
+        Подписчики каналов пакетами channels.GetChannels по закэшированным access_hash.
+        Каналы без резолва этим аккаунтом или без participants_count в ответе
+        остаются полному циклу. Возвращает число обновленных каналов.
+        """
+        if not channels:
+            return 0
+        
+        try:
+            if not await self.ensure_connected():
+                print(f"❌ Нет подключения к Telegram")
+                return 0
+            
+            entities = await db.get_channel_entities([channel.id for channel in channels], self.session_name)
+            channel_by_peer = {entity.peer_id: entity.channel_id for entity in entities}
+            
+            counts = []
+            for i in range(0, len(entities), CHANNELS_IDS_BATCH):
+                batch = [InputChannel(entity.peer_id, entity.access_hash) for entity in entities[i:i + CHANNELS_IDS_BATCH]]
+                result = await self._request('channels', lambda: self.client(GetChannelsRequest(batch)))
+                for chat in result.chats:
+                    subscribers = getattr(chat, 'participants_count', None)
+                    if subscribers is not None and chat.id in channel_by_peer:
+                        counts.append((channel_by_peer[chat.id], subscribers))
+            
+            updated = await db.update_subscribers_bulk(counts)
+            print(f"👥 [{self.session_name}] Подписчики: {updated} из {len(channels)} каналов "
+                  f"за {(len(entities) + CHANNELS_IDS_BATCH - 1) // CHANNELS_IDS_BATCH} запросов")
+            return updated
+            
+        except PROPAGATE_ERRORS:
+            raise
+        except Exception as e:
+            print(f"❌ Ошибка пакетного обновления подписчиков: {e}")
+            return 0
+    
+    async def refresh_channels(self, db, channels):
+        """Обновить переданные каналы пулом воркеров: (результаты, обработанные ID, ID с ошибкой, отброшенные каналы)"""
+        started_at = time.monotonic()
+        self.requests.reset_stats()
+        self.row_stats = {'changed': 0, 'unchanged': 0}
+        
+        queue = asyncio.Queue()
+        for channel in channels:
+            queue.put_nowait((channel, 0))
+        loop = asyncio.get_running_loop()
+        
+        results = []
+        processed_ids = []
+        failed_ids = []
+        dropped = []
+        requeued = 0
+        
+        def requeue(item):
+            # Сначала новая запись, потом закрываем старую - join() не завершится раньше времени
+            queue.put_nowait(item)
+            queue.task_done()
+        
+        async def worker():
+            nonlocal requeued
+            while True:
+                item = await queue.get()
+                (channel_id, username, title), attempt = item
+                deferred = False
+                try:
+                    if self.unauthorized:
+                        dropped.append(item[0])
+                        continue
+                    
+                    print(f"📊 Обновляю {title}...")
+                    
+                    # Для каждого канала проверяем соединение
+                    if not await self.ensure_connected():
+                        print(f"❌ Потеряно соединение, пропускаю {username}")
+                        failed_ids.append(channel_id)
+                        continue
+                    
+                    result = await self.update_channel_stats(username, db)
+                    processed_ids.append(channel_id)
+                    if result:
+                        results.append(result)
+                        
+                except FloodWaitDeferred as e:
+                    if attempt < config.FLOOD_MAX_REQUEUES and e.seconds <= config.FLOOD_MAX_DEFER:
+                        # Канал не теряется: вернется в очередь, когда пауза метода кончится
+                        print(f"↩️ {username} отложен на {e.seconds:.0f} сек. ({e.method})")
+                        loop.call_later(e.seconds, requeue, ((channel_id, username, title), attempt + 1))
+                        requeued += 1
+                        deferred = True
+                    else:
+                        print(f"⏭️ {username} пропущен аккаунтом {self.session_name}: {e}")
+                        dropped.append(item[0])
+                except UNAUTHORIZED_ERRORS as e:
+                    print(f"🚫 Аккаунт {self.session_name} не авторизован: {e}")
+                    self.unauthorized = True
+                    self.connected = False
+                    dropped.append(item[0])
+                except Exception as e:
+                    print(f"❌ Ошибка обновления {username}: {e}")
+                    failed_ids.append(channel_id)
+                finally:
+                    if not deferred:
+                        queue.task_done()
         
-        # Принудительно переподключаемся перед массовым обновлением
-        await self.connect()
+        # Частоту запросов ограничивает RequestScheduler, а не пауза после каждого канала
+        workers_count = max(1, min(config.PARSE_WORKERS, len(channels)))
+        workers = [asyncio.create_task(worker()) for _ in range(workers_count)]
+        try:
+            await queue.join()
+        finally:
+            for task in workers:
+                task.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
         
+        elapsed = time.monotonic() - started_at
+        flood = self.requests.stats()
+        self.last_cycle_stats = {
+            'channels': len(channels),
+            'updated': len(results),
+            'requeued': requeued,
+            'failed': len(failed_ids),
+            'dropped': len(dropped),
+            'elapsed': elapsed,
+            **self.row_stats,
+            **flood
+        }
+        print(f"🌊 [{self.session_name}] Флуд-вейты: {flood['flood_waits'] or 'нет'}, "
+              f"заблокировано {flood['blocked_seconds']:.0f} сек., отложено каналов {requeued}, пропущено {len(dropped)}")
+        print(f"🧮 [{self.session_name}] Строк posts переписано {self.row_stats['changed']}, "
+              f"пропущено без изменений {self.row_stats['unchanged']}")
+        health = self.health.stats()
+        print(f"🩺 [{self.session_name}] Проверки соединения: {health['probes']}, "
+              f"пропущено: {health['probes_skipped']}, сбоев: {health['failures']}")
+        return results, processed_ids, failed_ids, dropped
+
+
+async def load_cycle_channels(db, only_due):
+    """Каналы для цикла обновления"""
+    if only_due:
+        channels = await db.get_due_channels()
+        if not channels:
+            print("📭 Нет каналов, которым пора обновляться")
+        return channels
+    
+    channels = await db.get_all_approved_channels()
+    if not channels:
+        print("📭 Нет одобренных каналов")
+    return channels
+
+
+async def finish_cycle(db, processed_ids, failed_ids):
+    """Общее завершение цикла: сроки обновления, рост, снимки топов"""
+    # Канал с ошибкой не дергаем каждый тик: пауза растет с числом ошибок подряд
+    await db.schedule_failed_refresh(failed_ids, config.REFRESH_MIN_INTERVAL, config.REFRESH_MAX_INTERVAL)
+    if not processed_ids:
+        return
+    
+    # Следующий срок каждого обработанного канала - по его активности
+    stats = await db.get_refresh_stats(processed_ids)
+    await db.schedule_refresh([
+        (s.channel_id, refresh_interval(s.posts_7d, s.fresh_views, s.growth_7d))
+        for s in stats
+    ])
+    
+    # Рост всех каналов - одним запросом после цикла, затем снимки топов
+    await db.refresh_growth()
+    await db.rebuild_leaderboards()
+
+
+class HashRing:
+    """Консистентное хеширование каналов по аккаунтам"""
+    
+    def __init__(self, nodes, replicas=HASH_RING_REPLICAS):
+        self.ring = sorted((self._hash(f"{node}#{i}"), node) for node in nodes for i in range(replicas))
+        self.keys = [h for h, _ in self.ring]
+    
+    @staticmethod
+    def _hash(key: str) -> int:
+        return int(hashlib.md5(key.encode()).hexdigest()[:16], 16)
+    
+    def lookup(self, key: str, exclude=()):
+        """Первый по кольцу узел для ключа, кроме исключенных"""
+        if not self.ring:
+            return None
+        start = bisect.bisect(self.keys, self._hash(key.lower()))
+        for i in range(len(self.ring)):
+            node = self.ring[(start + i) % len(self.ring)][1]
+            if node not in exclude:
+                return node
+        return None
+
+
+class ParserPool:
+    """Несколько аккаунтов Telethon: каналы делятся между ними по кольцу хешей"""
+    
+    def __init__(self, accounts=None):
+        accounts = accounts or config.PARSER_ACCOUNTS
+        self.shards = {account['session_name']: TelegramParser(**account) for account in accounts}
+        self.ring = HashRing(list(self.shards))
+        # Аккаунт -> до какого момента (monotonic) его не использовать
+        self.unhealthy_until = {}
+        self.shard_stats = {}
+    
+    def _unhealthy(self) -> set:
+        now = time.monotonic()
+        return {name for name, until in self.unhealthy_until.items() if until > now}
+    
+    def _mark_unhealthy(self, name, seconds, reason):
+        seconds = max(seconds, 60)
+        self.unhealthy_until[name] = time.monotonic() + seconds
+        print(f"⚠️ Аккаунт {name} выведен из кольца на {seconds:.0f} сек.: {reason}")
+    
+    def shard_for(self, username):
+        """Аккаунт, который обслуживает канал"""
+        name = self.ring.lookup(username, exclude=self._unhealthy())
+        return self.shards[name] if name else None
+    
+    async def connect(self):
+        """Подключить все аккаунты"""
+        names = list(self.shards)
+        connected = await asyncio.gather(*(self.shards[name].connect() for name in names))
+        for name, ok in zip(names, connected):
+            if not ok:
+                self._mark_unhealthy(name, SHARD_RETRY_AFTER, "нет подключения")
+        return any(connected)
+    
+    async def ensure_connected(self):
+        """Проверить живые аккаунты; True, если работает хотя бы один"""
+        unhealthy = self._unhealthy()
+        alive = False
+        for name, shard in self.shards.items():
+            if name in unhealthy:
+                continue
+            if await shard.ensure_connected() and not shard.unauthorized:
+                alive = True
+            else:
+                self._mark_unhealthy(name, SHARD_RETRY_AFTER, "нет подключения")
+        return alive
+    
+    async def close(self):
+        for shard in self.shards.values():
+            await shard.close()
+    
+    async def update_channel_stats(self, username, db):
+        """Обновить один канал аккаунтом, за которым он закреплен"""
+        shard = self.shard_for(username)
+        if shard is None:
+            print(f"❌ Нет доступных аккаунтов для {username}")
+            return None
+        return await shard.update_channel_stats(username, db)
+    
+    async def refresh_subscribers(self, db):
+        """Подписчики всех одобренных каналов: каждый аккаунт обновляет свою часть кольца"""
         channels = await db.get_all_approved_channels()
         if not channels:
-            print("📭 Нет одобренных каналов")
+            return 0
+        
+        unhealthy = self._unhealthy()
+        assignment = {}
+        for channel in channels:
+            name = self.ring.lookup(channel.username, exclude=unhealthy)
+            if name:
+                assignment.setdefault(name, []).append(channel)
+        
+        async def run(name, subset):
+            shard = self.shards[name]
+            try:
+                return await shard.refresh_subscribers(db, subset)
+            except FloodWaitDeferred as e:
+                self._mark_unhealthy(name, e.seconds, "флуд-лимит")
+            except UNAUTHORIZED_ERRORS as e:
+                shard.unauthorized = True
+                self._mark_unhealthy(name, SHARD_RETRY_AFTER, f"аккаунт не авторизован: {e}")
+            return 0
+        
+        updated = await asyncio.gather(*(run(name, subset) for name, subset in assignment.items()))
+        return sum(updated)
+    
+    async def _run_shard(self, name, db, channels):
+        shard = self.shards[name]
+        started_at = time.monotonic()
+        results, processed_ids, failed_ids, dropped = await shard.refresh_channels(db, channels)
+        elapsed = time.monotonic() - started_at
+        
+        stats = self.shard_stats.setdefault(name, {'channels': 0, 'updated': 0, 'elapsed': 0.0,
+                                                   'flood_waits': 0, 'blocked_seconds': 0.0,
+                                                   'changed': 0, 'unchanged': 0})
+        stats['channels'] += len(channels)
+        stats['updated'] += len(results)
+        stats['elapsed'] += elapsed
+        stats['flood_waits'] += sum(shard.last_cycle_stats.get('flood_waits', {}).values())
+        stats['blocked_seconds'] += shard.last_cycle_stats.get('blocked_seconds', 0)
+        stats['changed'] += shard.last_cycle_stats.get('changed', 0)
+        stats['unchanged'] += shard.last_cycle_stats.get('unchanged', 0)
+        
+        if shard.unauthorized:
+            self._mark_unhealthy(name, SHARD_RETRY_AFTER, "аккаунт не авторизован")
+        elif dropped:
+            # Аккаунт уперся во флуд-лимит - его каналы уходят соседям по кольцу
+            self._mark_unhealthy(name, shard.requests.longest_pause(), "флуд-лимит")
+        
+        return results, processed_ids, failed_ids, dropped
+    
+    async def update_all_channels(self, db, only_due=False):
+        """Обновить каналы всеми аккаунтами параллельно"""
+        print("🔄 Начинаю обновление каналов..." if only_due else "🔄 Начинаю обновление всех каналов...")
+        
+        if not await self.ensure_connected():
+            print("❌ Нет подключения к Telegram, обновление отменено")
+            return []
+        
+        channels = await load_cycle_channels(db, only_due)
+        if not channels:
             return []
         
+        started_at = time.monotonic()
+        self.shard_stats = {}
         results = []
-        for channel_id, username, title in channels:
-            print(f"📊 Обновляю {title}...")
+        processed_ids = []
+        failed_ids = []
+        # Канал -> аккаунты, которые уже не смогли его обновить
+        tried = {}
+        pending = channels
+        
+        while pending:
+            unhealthy = self._unhealthy()
+            assignment = {}
+            for channel in pending:
+                name = self.ring.lookup(channel.username, exclude=unhealthy | tried.get(channel.id, set()))
+                if name is None:
+                    print(f"⚠️ Нет свободных аккаунтов для {channel.username}, ждет следующего цикла")
+                    continue
+                assignment.setdefault(name, []).append(channel)
             
-            # Для каждого канала проверяем соединение
-            if not await self.ensure_connected():
-                print(f"❌ Потеряно соединение, пропускаю {username}")
-                continue
+            if not assignment:
+                break
             
-            result = await self.update_channel_stats(username, db)
-            if result:
-                results.append(result)
+            outcomes = await asyncio.gather(*(self._run_shard(name, db, subset) for name, subset in assignment.items()))
             
-            await asyncio.sleep(3)
+            pending = []
+            for name, (shard_results, shard_processed, shard_failed, dropped) in zip(assignment, outcomes):
+                results.extend(shard_results)
+                processed_ids.extend(shard_processed)
+                failed_ids.extend(shard_failed)
+                for channel in dropped:
+                    tried.setdefault(channel.id, set()).add(name)
+                pending.extend(dropped)
+        
+        await finish_cycle(db, processed_ids, failed_ids)
         
-        print(f"✅ Обновлено {len(results)} каналов")
+        elapsed = time.monotonic() - started_at
+        print(f"✅ Обновлено {len(results)} каналов за {elapsed:.0f} сек. ({len(self.shards)} аккаунтов)")
+        for name, stats in self.shard_stats.items():
+            per_minute = stats['updated'] / stats['elapsed'] * 60 if stats['elapsed'] else 0
+            print(f"   🔑 {name}: {stats['updated']}/{stats['channels']} каналов, {per_minute:.1f} кан./мин, "
+                  f"флуд-вейтов {stats['flood_waits']}, заблокировано {stats['blocked_seconds']:.0f} сек.")
+        changed = sum(stats['changed'] for stats in self.shard_stats.values())
+        unchanged = sum(stats['unchanged'] for stats in self.shard_stats.values())
+        print(f"🧮 Строк posts переписано {changed}, пропущено без изменений {unchanged}")
         return results
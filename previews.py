@@ -0,0 +1,52 @@
+import hashlib
+from typing import Optional
+
+# Сколько слов хранится в превью поста (больше нигде не показывается)
+PREVIEW_WORDS = 15
+NO_TEXT = "Нет текста"
+
+MARKDOWN_SPECIAL_CHARS = ['_', '*', '[', ']', '(', ')', '~', '`', '>', '#', '+', '-', '=', '|', '{', '}', '.', '!']
+ELLIPSIS = "\\.\\.\\."
+
+
+def escape_markdown(text: str) -> str:
+    """Экранирует специальные символы для Markdown"""
+    if not text:
+        return ""
+    for char in MARKDOWN_SPECIAL_CHARS:
+        text = text.replace(char, f'\\{char}')
+    return text
+
+
+def make_preview(text: str) -> str:
+    """
+    Превью для хранения: первые PREVIEW_WORDS слов, уже экранированные.
+    Если слов больше, в конце стоит экранированное многоточие.
+    """
+    if not text or not isinstance(text, str):
+        return ""
+
+    words = text.split()
+    preview = ' '.join(words[:PREVIEW_WORDS])
+    if len(words) > PREVIEW_WORDS:
+        preview += "..."
+    return escape_markdown(preview)
+
+
+def shorten_preview(preview: str, word_limit: int = PREVIEW_WORDS) -> str:
+    """Первые word_limit слов сохраненного превью (экранирование пробелов не добавляет)"""
+    if not preview:
+        return NO_TEXT
+
+    words = preview.split()
+    if len(words) <= word_limit:
+        return preview
+
+    return ' '.join(words[:word_limit]) + ELLIPSIS
+
+
+def text_hash(text: str) -> Optional[bytes]:
+    """Хэш полного текста: совпадает с decode(md5(text), 'hex') в PostgreSQL"""
+    if not text:
+        return None
+    return hashlib.md5(text.encode()).digest()
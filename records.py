@@ -0,0 +1,111 @@
+from datetime import datetime
+from typing import NamedTuple, Optional
+
+
+class PostRecord(NamedTuple):
+    """Пост канала, как его отдает парсер (у обновления метрик нет текста)"""
+    message_id: int
+    views: int
+    reactions: int
+    forwards: int
+    date: Optional[datetime] = None
+    text: str = ''
+
+
+class TopPostRecord(NamedTuple):
+    """Строка топа постов: value - метрика доски, preview - экранированное превью текста"""
+    channel_id: int
+    username: str
+    title: str
+    message_id: int
+    value: int
+    date: datetime
+    preview: str
+
+
+class ChannelRecord(NamedTuple):
+    """Канал со всеми полями таблицы channels"""
+    id: int
+    username: str
+    title: str
+    description: Optional[str]
+    added_by: int
+    status: str
+    subscribers: int
+    growth_7d: float
+    growth_30d: float
+    created_at: datetime
+    updated_at: datetime
+
+
+class ChannelGrowthRecord(NamedTuple):
+    """Строка топа каналов по росту"""
+    channel_id: int
+    username: str
+    title: str
+    subscribers: int
+    growth_7d: float
+    growth_30d: float
+
+
+class ChannelRefRecord(NamedTuple):
+    """Канал для цикла парсера"""
+    id: int
+    username: str
+    title: str
+
+
+class PendingChannelRecord(NamedTuple):
+    """Канал на модерации"""
+    id: int
+    username: str
+    title: str
+    added_by: int
+    created_at: datetime
+
+
+class ChannelSummaryRecord(NamedTuple):
+    """Строка списка каналов для админа"""
+    id: int
+    username: str
+    title: str
+    status: str
+    subscribers: int
+
+
+class HorizonGrowthRecord(NamedTuple):
+    """Рост канала за произвольный горизонт (по ежедневным точкам и сводкам)"""
+    channel_id: int
+    subscribers: int
+    old_subscribers: int
+    growth: float
+
+
+class RefreshStatsRecord(NamedTuple):
+    """Активность канала для расчета следующего обновления"""
+    channel_id: int
+    posts_7d: int
+    fresh_views: int
+    growth_7d: float
+
+
+class ChannelEntityRecord(NamedTuple):
+    """Закэшированный резолв канала аккаунтом парсера"""
+    peer_id: int
+    access_hash: int
+    resolved_at: datetime
+
+
+class ChannelPeerRecord(NamedTuple):
+    """Канал каталога и его резолв для пакетных запросов"""
+    channel_id: int
+    peer_id: int
+    access_hash: int
+
+
+class ParseJobRecord(NamedTuple):
+    """Задача воркера парсера из очереди parse_jobs"""
+    id: int
+    kind: str
+    channel_id: Optional[int]
+    requested_by: Optional[int]
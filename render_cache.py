@@ -0,0 +1,30 @@
+class RenderCache:
+    """Кэш отрисованных топов: (текст, клавиатура) по доске и поколению данных"""
+
+    def __init__(self):
+        # Поколение данных растет при каждом завершенном цикле парсера
+        self.generation = 0
+        self.entries = {}
+        self.hits = 0
+        self.misses = 0
+
+    async def get_or_render(self, key, render):
+        """Вернуть готовый ответ или отрисовать его через render()"""
+        entry = self.entries.get(key)
+        if entry and entry[0] == self.generation:
+            self.hits += 1
+            return entry[1]
+
+        self.misses += 1
+        generation = self.generation
+        rendered = await render()
+        # Пока рисовали, данные могли смениться - такой ответ не кэшируем
+        if generation == self.generation:
+            self.entries[key] = (generation, rendered)
+        return rendered
+
+    def invalidate(self):
+        """Сбросить кэш после обновления данных"""
+        self.generation += 1
+        self.entries.clear()
+        print(f"♻️ Кэш топов сброшен (попаданий {self.hits}, промахов {self.misses})")
@@ -0,0 +1,126 @@
+import asyncio
+import time
+from datetime import datetime, timedelta
+
+import pytz
+
+# Все расписания считаются по времени Владивостока
+TIMEZONE = pytz.timezone('Asia/Vladivostok')
+
+# Длинные ожидания режем на куски, чтобы не копить дрейф часов
+MAX_SLEEP = 3600
+
+
+def now_local() -> datetime:
+    return datetime.now(TIMEZONE)
+
+
+class Job:
+    """Задача планировщика: по расписанию (день недели/час/минута) или с интервалом"""
+
+    def __init__(self, name, func, weekday=None, hour=None, minute=0, interval=None, misfire_grace=None):
+        self.name = name
+        self.func = func
+        self.weekday = weekday
+        self.hour = hour
+        self.minute = minute
+        self.interval = interval
+        # Сколько секунд после пропущенного срока еще имеет смысл догонять (None - всегда)
+        self.misfire_grace = misfire_grace
+
+    def _at(self, day: datetime) -> datetime:
+        naive = datetime(day.year, day.month, day.day, self.hour or 0, self.minute)
+        return TIMEZONE.localize(naive)
+
+    def previous_fire(self, now: datetime) -> datetime:
+        """Последний срок по расписанию не позже now"""
+        day = now
+        for _ in range(8):
+            fire = self._at(day)
+            if fire <= now and (self.weekday is None or fire.weekday() == self.weekday):
+                return fire
+            day -= timedelta(days=1)
+        return self._at(day)
+
+    def next_fire(self, now: datetime) -> datetime:
+        """Ближайший срок по расписанию строго после now"""
+        day = now
+        for _ in range(8):
+            fire = self._at(day)
+            if fire > now and (self.weekday is None or fire.weekday() == self.weekday):
+                return fire
+            day += timedelta(days=1)
+        return self._at(day)
+
+    def due_at(self, last_run, now: datetime) -> datetime:
+        """Когда запускаться, учитывая последний запуск из базы"""
+        if self.interval:
+            if last_run is None:
+                return now
+            # Фиксированный темп: отсчет от срока прошлого запуска, а не от его окончания
+            return max(last_run + timedelta(seconds=self.interval), now)
+
+        missed = self.previous_fire(now)
+        if last_run is not None and last_run < missed:
+            late = (now - missed).total_seconds()
+            if self.misfire_grace is None or late <= self.misfire_grace:
+                print(f"⏪ {self.name}: пропущен запуск {missed.strftime('%d.%m %H:%M')}, догоняю")
+                return now
+        return self.next_fire(now)
+
+
+class Scheduler:
+    """Планировщик: спит ровно до следующего срока, состояние хранит в базе"""
+
+    def __init__(self, db):
+        self.db = db
+        self.jobs = []
+        self.tasks = []
+
+    def add_cron(self, name, func, weekday=None, hour=0, minute=0, misfire_grace=None):
+        self.jobs.append(Job(name, func, weekday=weekday, hour=hour, minute=minute, misfire_grace=misfire_grace))
+
+    def add_interval(self, name, func, seconds):
+        self.jobs.append(Job(name, func, interval=seconds))
+
+    def start(self):
+        for job in self.jobs:
+            self.tasks.append(asyncio.create_task(self._run(job)))
+
+    async def _sleep_until(self, fire: datetime):
+        while True:
+            remaining = (fire - now_local()).total_seconds()
+            if remaining <= 0:
+                return
+            await asyncio.sleep(min(remaining, MAX_SLEEP))
+
+    async def _run(self, job: Job):
+        last_run = await self.db.get_job_last_run(job.name)
+        if last_run is None and not job.interval:
+            # Первый запуск по расписанию: прошлые сроки не догоняем
+            last_run = now_local()
+
+        while True:
+            fire = job.due_at(last_run, now_local())
+            print(f"🗓️ {job.name}: следующий запуск {fire.astimezone(TIMEZONE).strftime('%d.%m %H:%M:%S')}")
+            await self._sleep_until(fire)
+
+            # Срок по расписанию (при догоне - пропущенный), одинаковый во всех процессах.
+            # Интервальную задачу другой процесс мог запустить чуть раньше - ее срок не ближе полуинтервала
+            slot = fire if job.interval else job.previous_fire(fire)
+            min_gap = job.interval / 2 if job.interval else 0
+            if not await self.db.claim_job_run(job.name, slot, min_gap):
+                print(f"⏭️ {job.name}: запуск уже выполняет другой процесс")
+                last_run = await self.db.get_job_last_run(job.name) or slot
+                continue
+
+            started = time.perf_counter()
+            try:
+                await job.func()
+            except Exception as e:
+                print(f"❌ Ошибка задачи {job.name}: {e}")
+            duration = time.perf_counter() - started
+
+            # Отмечаем плановый срок, чтобы темп не сдвигался на время выполнения
+            last_run = slot
+            await self.db.set_job_last_run(job.name, slot, duration)
@@ -0,0 +1,182 @@
+import asyncio
+from datetime import datetime
+
+from aiogram import Bot
+
+import config
+import database
+import parser
+from scheduler import Scheduler
+
+# Как часто проверять очередь задач, если уведомление NOTIFY потерялось (сек.)
+JOBS_POLL_INTERVAL = 30
+
+
+class ParserWorker:
+    """Сбор статистики: автообновление по расписанию и задачи из очереди parse_jobs"""
+
+    def __init__(self, db, telegram_parser, bot=None):
+        self.db = db
+        self.parser = telegram_parser
+        # Бот нужен только чтобы сообщить админу о результате задачи
+        self.bot = bot
+        # Плановый цикл и ручное обновление не идут одновременно
+        self.cycle_lock = asyncio.Lock()
+        self.wakeup = asyncio.Event()
+
+    async def scheduled_parser(self):
+        """Автообновление статистики"""
+        try:
+            if await self.parser.ensure_connected():
+                print(f"\n⏰ {datetime.now().strftime('%H:%M')} - Автообновление...")
+                async with self.cycle_lock:
+                    results = await self.parser.update_all_channels(self.db, only_due=True)
+                print(f"✅ Обновлено {len(results)} каналов")
+        except Exception as e:
+            print(f"❌ Ошибка автообновления: {e}")
+
+    async def scheduled_subscribers(self):
+        """Пакетное обновление подписчиков между циклами сбора постов"""
+        try:
+            if await self.parser.ensure_connected():
+                async with self.cycle_lock:
+                    if await self.parser.refresh_subscribers(self.db):
+                        await self.db.rebuild_leaderboards()
+        except Exception as e:
+            print(f"❌ Ошибка обновления подписчиков: {e}")
+    
+    async def run_job(self, job_id, kind, channel_id, requested_by):
+        """Выполнить одну задачу и сообщить о результате"""
+        print(f"🧰 Задача #{job_id}: {kind}")
+        try:
+            if kind == 'refresh_all':
+                async with self.cycle_lock:
+                    results = await self.parser.update_all_channels(self.db)
+
+                text = f"✅ Обновлено {len(results)} каналов\n\n"
+                if results:
+                    text += "Последние обновления:\n"
+                    for result in results[:5]:
+                        text += f"• {result['title']}: {result['subscribers']:,} подписчиков\n"
+
+            elif kind == 'refresh_channel':
+                channel = await self.db.get_channel(channel_id)
+                if not channel:
+                    raise Exception(f"канал {channel_id} не найден")
+
+                await self.parser.ensure_connected()
+                async with self.cycle_lock:
+                    result = await self.parser.update_channel_stats(channel.username, self.db)
+                    await self.db.rebuild_leaderboards()
+
+                if result:
+                    text = f"✅ Статистика {result['title']} собрана: {result['subscribers']:,} подписчиков"
+                else:
+                    text = f"⚠️ Не удалось собрать статистику {channel.username}"
+
+            else:
+                raise Exception(f"неизвестный тип задачи {kind}")
+
+            await self.db.finish_parse_job(job_id, 'done', text)
+
+        except Exception as e:
+            text = f"❌ Ошибка: {e}"
+            print(f"❌ Задача #{job_id} не выполнена: {e}")
+            await self.db.finish_parse_job(job_id, 'failed', text)
+
+        if self.bot and requested_by:
+            try:
+                await self.bot.send_message(requested_by, text)
+            except Exception as e:
+                print(f"⚠️ Не удалось отправить результат задачи #{job_id}: {e}")
+
+    async def requeue_stale_jobs(self):
+        """Вернуть в очередь задачи, у которых истекла аренда"""
+        try:
+            stale = await self.db.requeue_stale_parse_jobs(config.PARSE_JOB_LEASE)
+            if stale:
+                print(f"↩️ Возвращено в очередь прерванных задач: {stale}")
+                self.wakeup.set()
+        except Exception as e:
+            print(f"❌ Ошибка возврата прерванных задач: {e}")
+
+    async def process_jobs(self):
+        """Разбирать очередь задач, просыпаясь по NOTIFY"""
+        await self.requeue_stale_jobs()
+
+        await self.db.listen('parse_jobs', lambda *args: self.wakeup.set())
+
+        while True:
+            self.wakeup.clear()
+            try:
+                job = await self.db.claim_parse_job()
+            except Exception as e:
+                print(f"❌ Ошибка чтения очереди задач: {e}")
+                job = None
+
+            if job is None:
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), timeout=JOBS_POLL_INTERVAL)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            await self.run_job(job.id, job.kind, job.channel_id, job.requested_by)
+
+    async def run(self):
+        """Подключить парсер, запустить расписание и очередь задач"""
+        print("\n🔗 Тестирую подключение парсера...")
+        try:
+            if await self.parser.connect():
+                print("✅ Парсер подключен!")
+            else:
+                print("⚠️ Парсер не подключен")
+        except Exception as e:
+            print(f"❌ Ошибка парсера: {e}")
+
+        # Парсер проверяет очередь каналов с фиксированным темпом
+        scheduler = Scheduler(self.db)
+        scheduler.add_interval("parser", self.scheduled_parser, config.PARSE_TICK)
+        scheduler.add_interval("subscribers", self.scheduled_subscribers, config.SUBSCRIBERS_TICK)
+        # Задачи других копий воркера, упавших посреди работы
+        scheduler.add_interval("parse_jobs_lease", self.requeue_stale_jobs, config.PARSE_JOB_LEASE)
+        # Партиции posts: новые недели наперед и удаление старых по сроку хранения
+        scheduler.add_cron("post_partitions", self.db.maintain_post_partitions, hour=4)
+        # Старая история подписчиков - в недельные и месячные сводки
+        scheduler.add_cron("subscribers_rollup", self.db.compact_subscribers_history, hour=4, minute=30)
+        scheduler.add_cron("post_series", self.db.prune_post_metrics_series, hour=4, minute=45)
+        scheduler.start()
+
+        await self.process_jobs()
+
+
+async def main():
+    print("\n" + "="*60)
+    print("🛠️ ВОРКЕР ПАРСЕРА")
+    print("="*60)
+
+    db = database.Database()
+    try:
+        await db.connect()
+    except Exception as e:
+        print(f"❌ Критическая ошибка: не удалось подключиться к БД")
+        print(f"❌ {e}")
+        return
+
+    telegram_parser = parser.ParserPool()
+    bot = Bot(token=config.BOT_TOKEN) if config.BOT_TOKEN else None
+
+    try:
+        await ParserWorker(db, telegram_parser, bot).run()
+    finally:
+        await telegram_parser.close()
+        if bot:
+            await bot.session.close()
+        await db.close()
+
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        print("\n👋 Воркер остановлен")